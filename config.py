@@ -29,16 +29,113 @@ try:
     LOG_FILE_LEVEL = os.environ.get("LOG_FILE_LEVEL", "ERROR").upper()
     LOG_TELEGRAM_LEVEL = os.environ.get("LOG_TELEGRAM_LEVEL", "ERROR").upper()
 
-    # Настройки для rate limiting и retry
-    REQUEST_DELAY = float(
-        os.environ.get("REQUEST_DELAY", "1.0")
-    )  # Задержка между запросами в секундах (1 сообщение в секунду для безопасности)
+    # Режим получения обновлений: polling (по умолчанию) или webhook
+    BOT_MODE = os.environ.get("BOT_MODE", "polling").lower()
+    if BOT_MODE not in ["polling", "webhook"]:
+        print(f"Warning: Invalid BOT_MODE '{BOT_MODE}', using 'polling' instead")
+        BOT_MODE = "polling"
+    WEBHOOK_URL = os.environ.get(
+        "WEBHOOK_URL", ""
+    )  # Публичный адрес (https://bot.example.com), на который Telegram шлет обновления
+    WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")  # Путь обработчика
+    WEBHOOK_SECRET = os.environ.get(
+        "WEBHOOK_SECRET", ""
+    )  # Секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+    WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")  # Адрес встроенного сервера
+    WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8080"))  # Порт встроенного сервера
+    if BOT_MODE == "webhook" and not (WEBHOOK_URL and WEBHOOK_SECRET):
+        raise ValueError("WEBHOOK_URL and WEBHOOK_SECRET are required in webhook mode")
+
+    # Настройки параллельной обработки обновлений
+    UPDATE_WORKERS = int(
+        os.environ.get("UPDATE_WORKERS", "8")
+    )  # Сколько обновлений обрабатывается одновременно (в разных чатах); 1 - строго по одному
+    UPDATE_QUEUE_LIMIT = int(
+        os.environ.get("UPDATE_QUEUE_LIMIT", "1000")
+    )  # Сколько обновлений может ждать в очередях, дальше прием новых приостанавливается
+
+    # Настройки для retry
     MAX_RETRIES = int(
         os.environ.get("MAX_RETRIES", "3")
     )  # Максимальное количество попыток
-    RETRY_DELAY = int(
+    RETRY_DELAY = float(
         os.environ.get("RETRY_DELAY", "5")
-    )  # Базовая задержка для повторных попыток
+    )  # Базовая задержка для повторных попыток (удваивается, со случайным разбросом)
+    RETRY_MAX_DELAY = float(
+        os.environ.get("RETRY_MAX_DELAY", "60")
+    )  # Потолок задержки между попытками в секундах
+
+    # Настройки параллельного розыгрыша и лимитов Telegram API
+    DRAW_CONCURRENCY = int(
+        os.environ.get("DRAW_CONCURRENCY", "20")
+    )  # Сколько чатов разыгрывается одновременно
+    TG_GLOBAL_RATE = float(
+        os.environ.get("TG_GLOBAL_RATE", "30")
+    )  # Запросов в секунду на весь бот (лимит Telegram ~30 msg/s)
+    TG_CHAT_RATE_PER_MINUTE = float(
+        os.environ.get("TG_CHAT_RATE_PER_MINUTE", "20")
+    )  # Запросов в минуту в один чат (лимит Telegram для групп ~20 msg/min)
+    TG_PRIVATE_CHAT_RATE_PER_MINUTE = float(
+        os.environ.get("TG_PRIVATE_CHAT_RATE_PER_MINUTE", "60")
+    )  # Запросов в минуту в личный чат (лимит Telegram ~1 msg/s), например меню админки
+    TG_CHAT_BURST = int(
+        os.environ.get("TG_CHAT_BURST", "12")
+    )  # Допустимая пачка запросов в один чат (анимация розыгрыша ~11 запросов)
+    TG_RETRY_AFTER_ATTEMPTS = int(
+        os.environ.get("TG_RETRY_AFTER_ATTEMPTS", "3")
+    )  # Сколько раз повторять запрос после ответа flood control (retry_after)
+
+    # Настройки circuit breaker для сбоев Telegram API
+    CB_FAILURE_THRESHOLD = int(
+        os.environ.get("CB_FAILURE_THRESHOLD", "5")
+    )  # Подряд идущих сетевых ошибок, после которых запросы перестают отправляться
+    CB_RECOVERY_TIMEOUT = float(
+        os.environ.get("CB_RECOVERY_TIMEOUT", "30")
+    )  # Через сколько секунд пробовать один пробный запрос
+
+    # Настройки догона пропущенных задач по расписанию
+    CATCHUP_GRACE_MINUTES = int(
+        os.environ.get("CATCHUP_GRACE_MINUTES", "180")
+    )  # Пропущенный запуск догоняется при старте, если опоздание не больше этого
+    CATCHUP_STAGGER = float(
+        os.environ.get("CATCHUP_STAGGER", "30")
+    )  # Пауза между догоняемыми задачами в секундах
+
+    # Настройки аренды ведущего экземпляра (несколько контейнеров на одной базе)
+    LEASE_TTL = float(
+        os.environ.get("LEASE_TTL", "60")
+    )  # Срок аренды в секундах: после него резервный экземпляр забирает роль
+    LEASE_HEARTBEAT = float(
+        os.environ.get("LEASE_HEARTBEAT", "20")
+    )  # Как часто продлевать аренду, в секундах (должно быть заметно меньше LEASE_TTL)
+
+    # Настройки кэшей в памяти
+    LEADERBOARD_CACHE_SIZE = int(
+        os.environ.get("LEADERBOARD_CACHE_SIZE", "500")
+    )  # Для скольких чатов держать готовый топ /stats (самые давно запрошенные вытесняются)
+    MEMBERSHIP_CACHE_SIZE = int(
+        os.environ.get("MEMBERSHIP_CACHE_SIZE", "10000")
+    )  # Сколько пар (пользователь, чат) помнить для проверок участия в игре
+    MEMBERSHIP_CACHE_TTL = float(
+        os.environ.get("MEMBERSHIP_CACHE_TTL", "300")
+    )  # Сколько секунд доверять закэшированному участию (важно при нескольких экземплярах)
+
+    # Настройки outbox (очереди рассылок с возобновлением после перезапуска)
+    OUTBOX_MAX_ATTEMPTS = int(
+        os.environ.get("OUTBOX_MAX_ATTEMPTS", "5")
+    )  # Попыток доставки одного сообщения рассылки
+    OUTBOX_RETRY_BASE = int(
+        os.environ.get("OUTBOX_RETRY_BASE", "30")
+    )  # Базовая задержка перед повтором в секундах (удваивается с каждой попыткой)
+    OUTBOX_POLL_INTERVAL = int(
+        os.environ.get("OUTBOX_POLL_INTERVAL", "60")
+    )  # Как часто фоновый воркер проверяет outbox, в секундах
+    OUTBOX_TTL_HOURS = int(
+        os.environ.get("OUTBOX_TTL_HOURS", "12")
+    )  # Недоставленные сообщения старше этого срока больше не отправляются
+    OUTBOX_SENDING_TIMEOUT = int(
+        os.environ.get("OUTBOX_SENDING_TIMEOUT", "600")
+    )  # Через сколько секунд захваченное, но не отмеченное сообщение снова ставится в очередь
 
     # Проверяем валидность уровней для файла и телеграма
     if LOG_FILE_LEVEL not in valid_levels:
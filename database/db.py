@@ -1,51 +1,93 @@
 import os
+import asyncio
 import functools
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 from database.models import Base
 from logger import logger
+from utils.retry import is_db_locked, retry_async
 
 DOCKER_ENV = os.getenv("DOCKER_ENV", "True") == "True"
-DB_PATH = "/app/croissant.db" if DOCKER_ENV else "croissant.db"
+# DB_PATH задает файл базы явно (например, временный для симуляции)
+DB_PATH = os.getenv("DB_PATH") or ("/app/croissant.db" if DOCKER_ENV else "croissant.db")
 ENGINE_ECHO = os.getenv("DB_ECHO", "False") == "True"
+
+# Профиль настройки SQLite, применяется к каждому новому соединению
+SQLITE_PRAGMAS = {
+    # WAL: читатели не блокируют писателя и наоборот
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    # NORMAL в режиме WAL: без fsync на каждый commit, база не портится при сбое
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    # Отображение файла базы в память, в байтах (256 МБ)
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    # Кэш страниц: отрицательное значение - в КиБ (64 МБ)
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),
+    # Временные таблицы и индексы в памяти
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+    # Сколько миллисекунд ждать снятия блокировки вместо "database is locked"
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")),
+}
+# Как часто сбрасывать WAL в основной файл базы, в секундах
+SQLITE_CHECKPOINT_INTERVAL = int(os.getenv("SQLITE_CHECKPOINT_INTERVAL", "300"))
+
 engine = create_async_engine(url=f"sqlite+aiosqlite:///{DB_PATH}", echo=ENGINE_ECHO)
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
-async def init_db():
-    """Инициализация базы данных - создание всех таблиц из моделей."""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+@event.listens_for(engine.sync_engine, "connect")
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Применение профиля SQLITE_PRAGMAS к новому соединению."""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
 
 
-async def create_missing_tables():
-    """Создание недостающих таблиц без пересоздания существующих."""
-    from database.models import DailySelection
-    from sqlalchemy import inspect
+async def get_sqlite_settings() -> dict:
+    """Фактические настройки SQLite активного соединения и размеры файлов базы."""
+    settings = {}
+    async with engine.connect() as conn:
+        for name in SQLITE_PRAGMAS:
+            result = await conn.exec_driver_sql(f"PRAGMA {name}")
+            settings[name] = result.scalar()
+    for suffix in ("", "-wal"):
+        path = f"{DB_PATH}{suffix}"
+        settings[f"file_size{suffix}"] = os.path.getsize(path) if os.path.exists(path) else 0
+    return settings
+
+
+async def checkpoint_wal(mode: str = "TRUNCATE"):
+    """Перенос WAL в основной файл базы. Возвращает (busy, страниц в логе, перенесено)."""
+    async with engine.connect() as conn:
+        result = await conn.exec_driver_sql(f"PRAGMA wal_checkpoint({mode})")
+        return tuple(result.fetchone())
 
-    async with engine.begin() as conn:
-        # Используем инспектор для проверки существования таблицы
-        def check_table_exists(sync_conn):
-            inspector = inspect(sync_conn)
-            return "daily_selections" in inspector.get_table_names()
 
-        table_exists = await conn.run_sync(check_table_exists)
+async def run_wal_checkpoint_worker():
+    """Фоновый периодический checkpoint, чтобы WAL-файл не разрастался."""
+    while True:
+        await asyncio.sleep(SQLITE_CHECKPOINT_INTERVAL)
+        try:
+            busy, log_pages, checkpointed = await checkpoint_wal()
+            logger.debug(
+                f"WAL checkpoint: страниц в логе {log_pages}, перенесено {checkpointed}"
+                + (" (база была занята)" if busy else "")
+            )
+        except Exception as e:
+            logger.error(f"Ошибка WAL checkpoint: {e}")
 
-        if not table_exists:
-            # Создаем только недостающую таблицу
-            def create_table(sync_conn):
-                DailySelection.__table__.create(sync_conn)
 
-            await conn.run_sync(create_table)
-            logger.info("✅ Таблица 'daily_selections' создана успешно")
-        else:
-            # logger.info("ℹ️ Таблица 'daily_selections' уже существует")
-            pass
+async def init_db():
+    """Инициализация базы данных - создание всех таблиц из моделей."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
 
 
 def with_session(func):
-    @functools.wraps(func)
-    async def wrapper(*args, **kwargs):
+    async def run(*args, **kwargs):
         async with async_session() as session:
             try:
                 result = await func(session, *args, **kwargs)
@@ -55,4 +97,13 @@ def with_session(func):
                 await session.rollback()
                 raise
 
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        # Транзакция откатывается целиком, поэтому при блокировке ее можно повторить
+        return await retry_async(
+            functools.partial(run, *args, **kwargs),
+            name=f"db.{func.__name__}",
+            retry_if=is_db_locked,
+        )
+
     return wrapper
@@ -0,0 +1,368 @@
+# database/migrations.py
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Connection,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    UniqueConstraint,
+    func,
+    inspect,
+    select,
+    text,
+    update,
+)
+
+from database.db import engine
+from database.models import DailySelection, SchemaVersion, User
+
+from logger import logger
+
+
+# ========== ШАГИ МИГРАЦИЙ ==========
+# Каждый шаг идемпотентен: проверяет наличие таблицы, индекса или колонки,
+# поэтому его можно применить к базе, созданной любой прошлой версией бота.
+
+
+def create_tables(conn: Connection, *tables: Table):
+    """Создание таблиц (вместе с их индексами), которых еще нет."""
+    for table in tables:
+        table.create(conn, checkfirst=True)
+
+
+def create_indexes(conn: Connection, *indexes: Index):
+    """Создание индексов, которых еще нет."""
+    for index in indexes:
+        index.create(conn, checkfirst=True)
+
+
+def add_column(conn: Connection, table: str, column: str, ddl: str):
+    """Добавление колонки, если ее еще нет (ddl - тип и ограничения для ALTER TABLE)."""
+    columns = {col["name"] for col in inspect(conn).get_columns(table)}
+    if column not in columns:
+        conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+
+
+def _users_ref(meta: MetaData) -> Table:
+    """Ссылка для внешних ключей на users.id (сама таблица шагом не создается)."""
+    return Table("users", meta, Column("id", Integer, primary_key=True))
+
+
+# Шаги 1-4 и 7 описывают таблицы такими, какими они были в своей версии, а не
+# берут их из моделей: примененная миграция должна создавать ровно то, что
+# создавала, как бы модели ни менялись потом (новые колонки и индексы - только
+# новыми миграциями)
+
+
+def _base_tables(conn: Connection):
+    meta = MetaData()
+    users = Table(
+        "users",
+        meta,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("telegram_id", Integer, unique=True, nullable=False),
+        Column("username", String, nullable=True),
+        Column("full_name", String, nullable=False),
+        Column("chat_id", Integer, nullable=False),
+        Column("in_game", Boolean),
+    )
+    user_buns = Table(
+        "user_buns",
+        meta,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+        Column("bun", String, nullable=False),
+        Column("count", Integer),
+        Column("chat_id", Integer, nullable=False),
+        Column("points", Integer, nullable=False),
+        UniqueConstraint("user_id", "bun", "chat_id", name="unique_user_bun_chat"),
+    )
+    buns = Table(
+        "buns",
+        meta,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("name", String, nullable=False, unique=True),
+        Column("points", Integer, nullable=False),
+    )
+    game_settings = Table(
+        "game_settings",
+        meta,
+        Column("id", Integer, primary_key=True),
+        Column("key", String(50), unique=True, nullable=False),
+        Column("value", Integer, nullable=False),
+        Column("description", Text),
+    )
+    create_tables(conn, users, user_buns, buns, game_settings)
+
+
+def _daily_selections(conn: Connection):
+    meta = MetaData()
+    _users_ref(meta)
+    daily_selections = Table(
+        "daily_selections",
+        meta,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("chat_id", Integer, nullable=False),
+        Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+        Column("selection_date", String, nullable=False),
+        Column("bun_name", String, nullable=False),
+        UniqueConstraint(
+            "chat_id", "selection_date", name="unique_chat_date_selection"
+        ),
+    )
+    create_tables(conn, daily_selections)
+
+
+def _outbox(conn: Connection):
+    outbox = Table(
+        "outbox",
+        MetaData(),
+        Column("id", Integer, primary_key=True, index=True),
+        Column("broadcast", String, nullable=False),
+        Column("chat_id", Integer, nullable=False),
+        Column("kind", String, nullable=False),
+        Column("payload", Text, nullable=True),
+        Column("status", String, nullable=False),
+        Column("attempts", Integer, nullable=False),
+        Column("next_attempt_at", DateTime, nullable=False),
+        Column("last_error", Text, nullable=True),
+        Column("created_at", DateTime, nullable=False),
+        Column("delivered_at", DateTime, nullable=True),
+        UniqueConstraint("broadcast", "chat_id", name="unique_broadcast_chat"),
+        Index("ix_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+    create_tables(conn, outbox)
+
+
+def _scheduler_tables(conn: Connection):
+    meta = MetaData()
+    job_runs = Table(
+        "job_runs",
+        meta,
+        Column("job", String, primary_key=True),
+        Column("last_success_at", DateTime, nullable=True),
+    )
+    leases = Table(
+        "leases",
+        meta,
+        Column("name", String, primary_key=True),
+        Column("holder", String, nullable=False),
+        Column("expires_at", DateTime, nullable=False),
+        Column("heartbeat_at", DateTime, nullable=False),
+    )
+    create_tables(conn, job_runs, leases)
+
+
+def _hot_path_indexes(conn: Connection):
+    # Индексы объявлены здесь, а не берутся из моделей: примененная миграция
+    # должна создавать ровно то, что создавала, как бы модели ни менялись потом
+    meta = MetaData()
+    users = Table(
+        "users", meta, Column("chat_id"), Column("in_game"), Column("username")
+    )
+    user_buns = Table(
+        "user_buns", meta, Column("user_id"), Column("chat_id"), Column("points")
+    )
+    daily_selections = Table(
+        "daily_selections",
+        meta,
+        Column("chat_id"),
+        Column("user_id"),
+        Column("selection_date"),
+    )
+    create_indexes(
+        conn,
+        Index("ix_users_chat_in_game", users.c.chat_id, users.c.in_game),
+        Index(
+            "ix_users_active_chat",
+            users.c.chat_id,
+            users.c.username,
+            sqlite_where=text("in_game = 1"),
+        ),
+        Index("ix_users_username_chat", users.c.username, users.c.chat_id),
+        Index("ix_user_buns_user_chat", user_buns.c.user_id, user_buns.c.chat_id),
+        Index(
+            "ix_user_buns_chat_user",
+            user_buns.c.chat_id,
+            user_buns.c.user_id,
+            user_buns.c.points,
+        ),
+        Index(
+            "ix_daily_selections_chat_user_date",
+            daily_selections.c.chat_id,
+            daily_selections.c.user_id,
+            daily_selections.c.selection_date,
+        ),
+        Index("ix_daily_selections_date", daily_selections.c.selection_date),
+    )
+
+
+def _chat_members_index(conn: Connection):
+    users = Table(
+        "users",
+        MetaData(),
+        Column("chat_id"),
+        Column("in_game"),
+        Column("full_name"),
+        Column("telegram_id"),
+    )
+    create_indexes(
+        conn,
+        Index(
+            "ix_users_chat_name",
+            users.c.chat_id,
+            users.c.in_game,
+            users.c.full_name,
+            users.c.telegram_id,
+        ),
+    )
+    # (chat_id, in_game) - префикс нового индекса, отдельный индекс только замедляет запись
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_users_chat_in_game")
+
+
+def _user_scores(conn: Connection):
+    meta = MetaData()
+    _users_ref(meta)
+    user_scores = Table(
+        "user_scores",
+        meta,
+        Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+        Column("chat_id", Integer, primary_key=True),
+        Column("total_points", Integer, nullable=False),
+        Column("total_buns", Integer, nullable=False),
+        Column("last_win", DateTime, nullable=True),
+        Index("ix_user_scores_chat_points", "chat_id", text("total_points DESC")),
+    )
+    user_buns = Table(
+        "user_buns",
+        meta,
+        Column("user_id"),
+        Column("chat_id"),
+        Column("points"),
+        Column("count"),
+    )
+    daily_selections = Table(
+        "daily_selections",
+        meta,
+        Column("user_id"),
+        Column("chat_id"),
+        Column("selection_date"),
+    )
+    create_tables(conn, user_scores)
+    # Заполняем итоги по уже начисленным булочкам и выборам дня
+    last_wins = (
+        select(
+            daily_selections.c.user_id,
+            daily_selections.c.chat_id,
+            func.max(daily_selections.c.selection_date).label("last_date"),
+        )
+        .group_by(daily_selections.c.user_id, daily_selections.c.chat_id)
+        .subquery()
+    )
+    totals = (
+        select(
+            user_buns.c.user_id,
+            user_buns.c.chat_id,
+            func.sum(user_buns.c.points),
+            func.sum(user_buns.c.count),
+            # selection_date хранится как YYYY-MM-DD, last_win - как DateTime
+            last_wins.c.last_date + " 00:00:00.000000",
+        )
+        .outerjoin(
+            last_wins,
+            (last_wins.c.user_id == user_buns.c.user_id)
+            & (last_wins.c.chat_id == user_buns.c.chat_id),
+        )
+        .group_by(user_buns.c.user_id, user_buns.c.chat_id)
+    )
+    conn.execute(
+        user_scores.insert()
+        .from_select(
+            ["user_id", "chat_id", "total_points", "total_buns", "last_win"], totals
+        )
+        .prefix_with("OR IGNORE")
+    )
+
+
+def _bun_weights(conn: Connection):
+    add_column(conn, "buns", "weight", "INTEGER NOT NULL DEFAULT 1")
+
+
+def _fairness_state(conn: Connection):
+    add_column(conn, "users", "last_selected_date", "VARCHAR")
+    add_column(conn, "users", "times_selected", "INTEGER NOT NULL DEFAULT 0")
+    # Переносим историю выборов в строки игроков
+    history = select(DailySelection).where(
+        DailySelection.user_id == User.id, DailySelection.chat_id == User.chat_id
+    )
+    conn.execute(
+        update(User).values(
+            last_selected_date=history.with_only_columns(
+                func.max(DailySelection.selection_date)
+            ).scalar_subquery(),
+            times_selected=history.with_only_columns(func.count()).scalar_subquery(),
+        )
+    )
+
+
+# Упорядоченный список миграций: (версия, описание, шаг).
+# Новые миграции только добавляются в конец, примененные не меняются.
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "Базовые таблицы: users, user_buns, buns, game_settings", _base_tables),
+    (2, "Таблица daily_selections", _daily_selections),
+    (3, "Таблица outbox", _outbox),
+    (4, "Таблицы job_runs и leases", _scheduler_tables),
+    (5, "Индексы на горячих запросах", _hot_path_indexes),
+    (6, "Индекс для постраничного списка игроков чата", _chat_members_index),
+    (7, "Таблица user_scores с итогами игроков", _user_scores),
+    (8, "Вес редкости булочек", _bun_weights),
+    (9, "Состояние честного выбора в users", _fairness_state),
+]
+
+
+def _apply_migrations(conn: Connection) -> list[tuple[int, str]]:
+    SchemaVersion.__table__.create(conn, checkfirst=True)
+    applied = set(conn.execute(select(SchemaVersion.version)).scalars().all())
+
+    done = []
+    for version, name, step in MIGRATIONS:
+        if version in applied:
+            continue
+        step(conn)
+        conn.execute(
+            SchemaVersion.__table__.insert().values(
+                version=version, name=name, applied_at=datetime.now()
+            )
+        )
+        done.append((version, name))
+    return done
+
+
+async def run_migrations() -> int:
+    """Применение недостающих миграций одной транзакцией. Возвращает текущую версию схемы."""
+    async with engine.connect() as conn:
+        # Явная транзакция: DDL в SQLite тоже откатывается, а второй экземпляр бота,
+        # стартующий одновременно, дождется окончания миграций
+        await conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            done = await conn.run_sync(_apply_migrations)
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+
+    for version, name in done:
+        logger.info(f"✅ Миграция {version} применена: {name}")
+    current = MIGRATIONS[-1][0]
+    if not done:
+        logger.info(f"Схема базы актуальна (версия {current})")
+    return current
@@ -1,4 +1,5 @@
 from sqlalchemy import (
+    text,
     Column,
     Integer,
     String,
@@ -6,9 +7,12 @@ from sqlalchemy import (
     ForeignKey,
     UniqueConstraint,
     Text,
+    DateTime,
+    Index,
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
+from datetime import datetime
 
 Base = declarative_base()
 
@@ -23,7 +27,22 @@ class User(Base):
     full_name = Column(String, nullable=False)  # Полное имя
     chat_id = Column(Integer, nullable=False)  # Чат, в котором пользователь играет
     in_game = Column(Boolean, default=False)  # Статус в игре
+    last_selected_date = Column(
+        String, nullable=True
+    )  # Когда последний раз был Булочкой Дня (YYYY-MM-DD), для честного выбора
+    times_selected = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )  # Сколько раз был Булочкой Дня
     buns = relationship("UserBun", back_populates="user")  # Связь с булочками
+    __table_args__ = (
+        Index(
+            "ix_users_active_chat", "chat_id", "username", sqlite_where=text("in_game = 1")
+        ),  # Только активные игроки: розыгрыш и список активных чатов
+        Index("ix_users_username_chat", "username", "chat_id"),  # Поиск по @username
+        Index(
+            "ix_users_chat_name", "chat_id", "in_game", "full_name", "telegram_id"
+        ),  # Игроки чата по статусу и постраничный список по имени
+    )
 
 
 class UserBun(Base):
@@ -41,6 +60,25 @@ class UserBun(Base):
         UniqueConstraint(
             "user_id", "bun", "chat_id", name="unique_user_bun_chat"
         ),  # Уникальность связки
+        Index("ix_user_buns_user_chat", "user_id", "chat_id"),  # Булочки игрока в чате
+        Index("ix_user_buns_chat_user", "chat_id", "user_id", "points"),  # Топ чата
+    )
+
+
+class UserScore(Base):
+    """Итоги игрока в чате: пересчитываются в той же транзакции, что и его булочки."""
+
+    __tablename__ = "user_scores"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)  # Игрок
+    chat_id = Column(Integer, primary_key=True)  # Чат
+    total_points = Column(Integer, nullable=False, default=0)  # Сумма очков по всем булочкам
+    total_buns = Column(Integer, nullable=False, default=0)  # Сколько булочек выпало всего
+    last_win = Column(DateTime, nullable=True)  # Когда последний раз стал Булочкой Дня
+    __table_args__ = (
+        Index(
+            "ix_user_scores_chat_points", "chat_id", text("total_points DESC")
+        ),  # Лидерборд и место игрока в чате
     )
 
 
@@ -52,6 +90,9 @@ class Bun(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False, unique=True)  # Название булочки, уникальное
     points = Column(Integer, nullable=False)  # Баллы за булочку
+    weight = Column(
+        Integer, nullable=False, default=1, server_default="1"
+    )  # Вес редкости: чем больше, тем чаще выпадает (1 - обычная)
 
 
 class GameSetting(Base):
@@ -78,4 +119,61 @@ class DailySelection(Base):
     
     __table_args__ = (
         UniqueConstraint("chat_id", "selection_date", name="unique_chat_date_selection"),
+        Index(
+            "ix_daily_selections_chat_user_date", "chat_id", "user_id", "selection_date"
+        ),  # История выборов игроков чата
+        Index("ix_daily_selections_date", "selection_date"),  # Выборы за день по всем чатам
+    )
+
+
+class OutboxMessage(Base):
+    """Очередь исходящих сообщений рассылок (переживает перезапуск бота)."""
+
+    __tablename__ = "outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    broadcast = Column(String, nullable=False)  # Ключ рассылки, например evening_humor:2025-01-31
+    chat_id = Column(Integer, nullable=False)  # Чат-получатель
+    kind = Column(String, nullable=False)  # Тип доставки: text или daily_bun
+    payload = Column(Text, nullable=True)  # Текст сообщения или сценарий анимации (JSON)
+    status = Column(String, nullable=False, default="pending")  # pending / sending / delivered / failed
+    attempts = Column(Integer, nullable=False, default=0)  # Сколько раз пытались доставить
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.now)  # Когда пробовать снова
+    last_error = Column(Text, nullable=True)  # Последняя ошибка доставки
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+    delivered_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("broadcast", "chat_id", name="unique_broadcast_chat"),
+        Index("ix_outbox_status_next_attempt", "status", "next_attempt_at"),
     )
+
+
+class JobRun(Base):
+    """Последний успешный запуск задач по расписанию (для догона пропущенных запусков)."""
+
+    __tablename__ = "job_runs"
+
+    job = Column(String, primary_key=True)  # Имя задачи, например daily_bun
+    last_success_at = Column(DateTime, nullable=True)  # Когда задача последний раз завершилась успешно
+
+
+class Lease(Base):
+    """Аренда роли ведущего экземпляра бота (только он выполняет задачи по расписанию)."""
+
+    __tablename__ = "leases"
+
+    name = Column(String, primary_key=True)  # Имя аренды, например scheduler
+    holder = Column(String, nullable=False)  # Экземпляр-владелец: host:pid:случайный суффикс
+    expires_at = Column(DateTime, nullable=False)  # Аренда действует до этого момента
+    heartbeat_at = Column(DateTime, nullable=False)  # Последнее продление
+
+
+class SchemaVersion(Base):
+    """Примененные миграции схемы базы (database/migrations.py)."""
+
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True)  # Номер миграции
+    name = Column(String, nullable=False)  # Описание миграции
+    applied_at = Column(DateTime, nullable=False, default=datetime.now)
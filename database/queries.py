@@ -1,41 +1,125 @@
-from sqlalchemy import func, select, delete
+from sqlalchemy import and_, bindparam, case, event, false, func, literal, select, delete, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 from database.db import with_session
-from database.models import User, UserBun, Bun, GameSetting, DailySelection
+from database.models import (
+    User,
+    UserBun,
+    Bun,
+    GameSetting,
+    DailySelection,
+    OutboxMessage,
+    JobRun,
+    Lease,
+    UserScore,
+)
 import random
-from datetime import datetime, timedelta
+from array import array
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+from typing import Callable
 
 from logger import logger
+from utils import clock
+from utils.bun_catalog import BunCatalog, bun_catalog
+from utils.cache import leaderboard_cache, membership_cache
+
+
+# ========== СБРОС КЭШЕЙ ПОСЛЕ COMMIT ==========
+# Ключи кэшей помечаются в сессии и сбрасываются только после успешного commit,
+# чтобы параллельное чтение не вернуло в кэш еще не зафиксированные данные.
+
+
+def _invalidate_after_commit(session: AsyncSession, cache, *keys):
+    """Пометка ключей кэша (объект с invalidate(*keys)) к сбросу после commit.
+
+    Без ключей после commit сбрасывается весь кэш.
+    """
+    pending = session.info.setdefault("cache_invalidation", {})
+    if not keys:
+        pending[cache] = None
+    elif pending.get(cache, set()) is not None:
+        pending.setdefault(cache, set()).update(keys)
+
+
+def _invalidate_leaderboard(session: AsyncSession, *chat_ids: int):
+    """Пометка топов чатов к сбросу после commit текущей транзакции."""
+    _invalidate_after_commit(session, leaderboard_cache, *chat_ids)
+
+
+def _invalidate_membership(session: AsyncSession, *keys: tuple[int, int]):
+    """Пометка участия (telegram_id, chat_id) к сбросу; без ключей - всего кэша."""
+    _invalidate_after_commit(session, membership_cache, *keys)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_cache_invalidation(session: Session):
+    pending = session.info.pop("cache_invalidation", None)
+    for cache, keys in (pending or {}).items():
+        cache.invalidate(*(keys or ()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_cache_invalidation(session: Session):
+    session.info.pop("cache_invalidation", None)
 
 
 @with_session
 async def add_user(
     session: AsyncSession, telegram_id: int, chat_id: int, username: str, full_name: str
 ):
-    """Добавление нового пользователя или обновление статуса в игре."""
-    result = await session.execute(select(User).where(User.telegram_id == telegram_id))
-    user = result.scalars().first()
-    if user:
-        if not user.in_game:
-            user.in_game = True
-            await session.commit()
-        return user
-    new_user = User(
+    """Добавление нового пользователя или обновление статуса в игре.
+
+    Один upsert по telegram_id: новый игрок вставляется, существующий
+    возвращается в игру (его чат и имена не меняются).
+    """
+    insert_stmt = sqlite_insert(User).values(
         telegram_id=telegram_id,
         chat_id=chat_id,
         username=username,
         full_name=full_name,
         in_game=True,
     )
-    session.add(new_user)
+    result = await session.scalars(
+        insert_stmt.on_conflict_do_update(
+            index_elements=["telegram_id"], set_={"in_game": True}
+        )
+        .returning(User)
+        .execution_options(populate_existing=True)
+    )
+    user = result.one()
+    _invalidate_leaderboard(session, user.chat_id)
+    # Сбрасываем закэшированное участие, в том числе "не участник"
+    _invalidate_membership(session, (telegram_id, chat_id), (telegram_id, user.chat_id))
     await session.commit()
-    return new_user
+    return user
+
+
+# Отличает "нет в кэше" от закэшированного "не участник" (None)
+_NOT_CACHED = object()
+
+
+async def get_user_by_id(telegram_id: int, chat_id: int):
+    """Получение пользователя по telegram_id и chat_id (через membership_cache).
+
+    Возвращает отсоединенный объект User: его колонки доступны, но менять
+    его нельзя - он общий для всех, кто прочитал его из кэша.
+    """
+    key = (telegram_id, chat_id)
+    user = membership_cache.get(key, _NOT_CACHED)
+    if user is _NOT_CACHED:
+        version = membership_cache.version
+        user = await _load_user_by_id(telegram_id, chat_id)
+        membership_cache.set(key, user, version=version)
+    return user
 
 
 @with_session
-async def get_user_by_id(session: AsyncSession, telegram_id: int, chat_id: int):
-    """Получение пользователя по telegram_id и chat_id."""
+async def _load_user_by_id(session: AsyncSession, telegram_id: int, chat_id: int):
+    """Пользователь по telegram_id и chat_id из базы (без кэша)."""
     result = await session.execute(
         select(User).where(User.telegram_id == telegram_id, User.chat_id == chat_id)
     )
@@ -51,6 +135,8 @@ async def add_user_to_game(session: AsyncSession, telegram_id: int, chat_id: int
     user = user.scalar_one_or_none()
     if user and not user.in_game:
         user.in_game = True
+        _invalidate_leaderboard(session, chat_id)
+        _invalidate_membership(session, (telegram_id, chat_id))
         await session.commit()
         return True
     return False
@@ -65,6 +151,8 @@ async def set_user_out_of_game(session: AsyncSession, telegram_id: int, chat_id:
     user = result.scalars().first()
     if user and user.in_game:
         user.in_game = False
+        _invalidate_leaderboard(session, chat_id)
+        _invalidate_membership(session, (telegram_id, chat_id))
         await session.commit()
         return True
     return False
@@ -73,6 +161,15 @@ async def set_user_out_of_game(session: AsyncSession, telegram_id: int, chat_id:
 @with_session
 async def get_fair_random_user(session: AsyncSession, chat_id: int):
     """Получение справедливо случайного пользователя из чата с учетом истории."""
+    return await _pick_fair_user(session, chat_id)
+
+
+async def _pick_fair_user(session: AsyncSession, chat_id: int):
+    """Справедливый выбор пользователя чата в рамках уже открытой сессии.
+
+    Состояние честности (last_selected_date, times_selected) хранится в строке
+    игрока, поэтому выбор - один запрос, не зависящий от длины истории чата.
+    """
     # Получаем всех активных пользователей чата с username
     result = await session.execute(
         select(User).where(
@@ -90,47 +187,16 @@ async def get_fair_random_user(session: AsyncSession, chat_id: int):
     if len(users) == 1:
         return users[0]
     
-    today = datetime.now().strftime("%Y-%m-%d")
-    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-    
-    # Получаем пользователя, который был выбран вчера
-    yesterday_result = await session.execute(
-        select(DailySelection.user_id).where(
-            DailySelection.chat_id == chat_id,
-            DailySelection.selection_date == yesterday
-        )
-    )
-    yesterday_user_id = yesterday_result.scalar()
-    
-    # Получаем историю выборов для всех пользователей в этом чате
-    history_result = await session.execute(
-        select(
-            DailySelection.user_id,
-            func.max(DailySelection.selection_date).label("last_selected")
-        ).where(
-            DailySelection.chat_id == chat_id
-        ).group_by(DailySelection.user_id)
-    )
-    selection_history = {user_id: last_date for user_id, last_date in history_result.fetchall()}
+    today = clock.now().date()
+    yesterday = (today - timedelta(days=1)).isoformat()
     
     # Формируем список кандидатов с весами
     candidates = []
     for user in users:
         # Пропускаем пользователя, который был выбран вчера (если есть альтернативы)
-        if len(users) > 1 and user.id == yesterday_user_id:
+        if user.last_selected_date == yesterday:
             continue
-            
-        # Рассчитываем вес на основе времени последнего выбора
-        if user.id in selection_history:
-            last_selected_date = selection_history[user.id]
-            days_since_selected = (datetime.now() - datetime.strptime(last_selected_date, "%Y-%m-%d")).days
-            # Чем больше дней прошло, тем больше вес (минимум 1)
-            weight = max(1, days_since_selected)
-        else:
-            # Пользователь никогда не был выбран - максимальный приоритет
-            weight = 999
-            
-        candidates.append((user, weight))
+        candidates.append((user, _fairness_weight(user.last_selected_date, today)))
     
     # Если все пользователи кроме вчерашнего отфильтровались, берем всех
     if not candidates:
@@ -148,47 +214,229 @@ async def get_fair_random_user(session: AsyncSession, chat_id: int):
     return selected_user
 
 
-@with_session  
-async def save_daily_selection(session: AsyncSession, chat_id: int, user_id: int, bun_name: str):
-    """Сохранение информации о ежедневном выборе."""
-    today = datetime.now().strftime("%Y-%m-%d")
-    
-    try:
-        # Проверяем, есть ли уже запись за сегодня для этого чата
-        existing_result = await session.execute(
-            select(DailySelection).where(
-                DailySelection.chat_id == chat_id,
-                DailySelection.selection_date == today
+# Вес игрока, который еще ни разу не был Булочкой Дня
+NEVER_SELECTED_WEIGHT = 999
+
+
+def _fairness_weight(last_selected_date: str | None, today: date) -> int:
+    """Вес кандидата: дней с последнего выбора (минимум 1) или максимальный приоритет."""
+    if not last_selected_date:
+        return NEVER_SELECTED_WEIGHT
+    # Чем больше дней прошло, тем больше вес (минимум 1)
+    return max(1, (today - date.fromisoformat(last_selected_date)).days)
+
+
+async def _pick_fair_users(
+    session: AsyncSession, chat_ids: list[int]
+) -> dict[int, tuple[int, str, str]]:
+    """Пакетный честный выбор в рамках открытой сессии: {chat_id: (id, username, full_name)}.
+
+    Кандидаты всех чатов читаются одним запросом на пачку из 500 чатов, веса
+    складываются в общий массив, а победитель каждого чата находится бинарным
+    поиском по префиксным суммам его отрезка.
+    """
+    today = clock.now().date()
+    yesterday = (today - timedelta(days=1)).isoformat()
+
+    members = []  # (id, username, full_name) в порядке строк
+    row_chats = array("q")
+    weights = array("d")
+    # Дат последнего выбора немного, поэтому разбираем каждую один раз
+    date_weights = {}
+    for i in range(0, len(chat_ids), 500):
+        result = await session.execute(
+            select(
+                User.chat_id,
+                User.id,
+                User.username,
+                User.full_name,
+                User.last_selected_date,
+            )
+            .where(
+                User.chat_id.in_(chat_ids[i : i + 500]),
+                User.in_game == True,
+                User.username.is_not(None),
+                User.username != "",
             )
+            .order_by(User.chat_id, User.id)
         )
-        existing_selection = existing_result.scalar_one_or_none()
-        
-        if existing_selection:
-            # Обновляем существующую запись
-            existing_selection.user_id = user_id
-            existing_selection.bun_name = bun_name
-            logger.debug(f"Обновлена запись о выборе для чата {chat_id} на {today}")
+        for chat_id, user_id, username, full_name, last_date in result:
+            members.append((user_id, username, full_name))
+            row_chats.append(chat_id)
+            if last_date == yesterday:
+                # Вчерашний победитель исключается (вес 0), если есть альтернативы
+                weights.append(0.0)
+            else:
+                if last_date not in date_weights:
+                    date_weights[last_date] = _fairness_weight(last_date, today)
+                weights.append(date_weights[last_date])
+
+    prefix = array("d", accumulate(weights))
+    picks = {}
+    start, total_rows = 0, len(members)
+    while start < total_rows:
+        chat_id = row_chats[start]
+        end = start
+        while end < total_rows and row_chats[end] == chat_id:
+            end += 1
+
+        base = prefix[start - 1] if start else 0.0
+        group_total = prefix[end - 1] - base
+        if end - start == 1:
+            picked = start
+        elif group_total <= 0:
+            # Все кандидаты отфильтровались - выбираем среди всех поровну
+            picked = random.randrange(start, end)
         else:
-            # Создаем новую запись
-            daily_selection = DailySelection(
-                chat_id=chat_id,
-                user_id=user_id,
-                selection_date=today,
-                bun_name=bun_name
+            target = base + random.random() * group_total
+            picked = min(bisect_right(prefix, target, start, end), end - 1)
+        picks[chat_id] = members[picked]
+        start = end
+
+    logger.debug(
+        f"Пакетный честный выбор: {len(picks)} чатов, {total_rows} кандидатов"
+    )
+    return picks
+
+
+async def _mark_selected(session: AsyncSession, user_ids: list[int], today: str):
+    """Обновление состояния честного выбора у новых победителей дня.
+
+    Игрок, уже отмеченный сегодня, повторно не считается.
+    """
+    for i in range(0, len(user_ids), 500):
+        await session.execute(
+            update(User)
+            .where(
+                User.id.in_(user_ids[i : i + 500]),
+                User.last_selected_date.is_distinct_from(today),
+            )
+            .values(last_selected_date=today, times_selected=User.times_selected + 1)
+        )
+
+
+@with_session
+async def draw_daily_winners(
+    session: AsyncSession,
+    chat_ids: list[int],
+    announce: tuple[str, str, Callable[[dict], dict[int, str]]] | None = None,
+) -> dict:
+    """Розыгрыш Булочки Дня сразу во всех чатах одной транзакцией.
+
+    Разыгрываются только чаты без выбора на сегодня (unique_chat_date_selection),
+    поэтому повторный запуск не начисляет булочки второй раз. Возвращает
+    {"buns": {name: points}, "winners": {chat_id: {"user_id", "display_name", "bun"}
+    или None}, "skipped": [chat_id, ...], "payloads": {chat_id: payload}}.
+
+    announce = (broadcast, kind, build_payloads): build_payloads(результат)
+    готовит сообщения для outbox, и они вставляются в той же транзакции, что и
+    победители, - розыгрыш и его объявление фиксируются или откатываются вместе.
+    """
+    today = clock.now().strftime("%Y-%m-%d")
+
+    # Чаты, где сегодня уже разыграли, пропускаем сразу
+    drawn = set()
+    for i in range(0, len(chat_ids), 500):
+        result = await session.execute(
+            select(DailySelection.chat_id).where(
+                DailySelection.selection_date == today,
+                DailySelection.chat_id.in_(chat_ids[i : i + 500]),
             )
-            session.add(daily_selection)
-            logger.info(f"Сохранен выбор Булочки Дня для чата {chat_id} на {today}")
-            
+        )
+        drawn.update(result.scalars().all())
+    skipped = [chat_id for chat_id in chat_ids if chat_id in drawn]
+
+    # Один снимок каталога на весь розыгрыш: выбор и очки булочки из него
+    # согласованы, даже если админ изменит булочки во время розыгрыша
+    catalog = await _load_bun_catalog(session)
+    buns = dict(catalog.points)
+    if not catalog:
+        logger.error("Таблица buns пуста, розыгрыш невозможен")
+        draw = {"buns": {}, "winners": {}, "skipped": skipped}
+        await _announce_draw(session, draw, announce)
         await session.commit()
-        
-    except IntegrityError as e:
-        await session.rollback()
-        logger.error(f"Ошибка при сохранении выбора дня для чата {chat_id}: {e}")
-        raise
-    except Exception as e:
-        await session.rollback()
-        logger.error(f"Неизвестная ошибка при сохранении выбора дня: {e}")
-        raise
+        return draw
+
+    pending = [chat_id for chat_id in chat_ids if chat_id not in drawn]
+    picks = await _pick_fair_users(session, pending)
+
+    winners = {}
+    selections = []
+    for chat_id in pending:
+        if chat_id not in picks:
+            logger.warning(f"Нет активных пользователей с username в чате {chat_id}")
+            winners[chat_id] = None
+            continue
+        selections.append(
+            {
+                "chat_id": chat_id,
+                "user_id": picks[chat_id][0],
+                "selection_date": today,
+                "bun_name": catalog.choose(),
+            }
+        )
+
+    # Выборы дня вставляются первыми: если параллельный розыгрыш успел раньше,
+    # ограничение уникальности не даст начислить булочку второй раз.
+    # RETURNING возвращает только чаты, где вставка действительно произошла
+    inserted = set()
+    if selections:
+        result = await session.execute(
+            sqlite_insert(DailySelection.__table__)
+            .on_conflict_do_nothing(index_elements=["chat_id", "selection_date"])
+            .returning(DailySelection.__table__.c.chat_id),
+            selections,
+        )
+        inserted.update(result.scalars().all())
+
+    selections = [row for row in selections if row["chat_id"] in inserted]
+    skipped.extend(
+        chat_id for chat_id in pending if chat_id in picks and chat_id not in inserted
+    )
+    await _mark_selected(session, [row["user_id"] for row in selections], today)
+
+    await _award_buns(
+        session,
+        [
+            (row["user_id"], row["bun_name"], row["chat_id"], buns[row["bun_name"]])
+            for row in selections
+        ],
+        won_at=clock.now(),
+    )
+    for row in selections:
+        chat_id, bun = row["chat_id"], row["bun_name"]
+        user_id, username, full_name = picks[chat_id]
+        winners[chat_id] = {
+            "user_id": user_id,
+            "display_name": f"@{username}" if username else full_name,
+            "bun": bun,
+        }
+
+    draw = {"buns": buns, "winners": winners, "skipped": skipped}
+    await _announce_draw(session, draw, announce)
+    await session.commit()
+    logger.info(
+        f"Розыгрыш Булочки Дня: разыграно {len(winners)} чатов, "
+        f"пропущено (уже разыграно сегодня) {len(skipped)}"
+    )
+    return draw
+
+
+async def _announce_draw(
+    session: AsyncSession,
+    draw: dict,
+    announce: tuple[str, str, Callable[[dict], dict[int, str]]] | None,
+):
+    """Постановка объявлений розыгрыша в outbox в его же транзакции."""
+    draw["payloads"] = {}
+    if announce is None:
+        return
+    broadcast, kind, build_payloads = announce
+    draw["payloads"] = build_payloads(draw)
+    if draw["payloads"]:
+        await _insert_outbox(
+            session, broadcast, list(draw["payloads"]), kind, payloads=draw["payloads"]
+        )
 
 
 # Оставляем старую функцию для совместимости, но помечаем как deprecated
@@ -203,67 +451,133 @@ async def get_random_user(session: AsyncSession, chat_id: int):
     return random.choice(users) if users else None
 
 
-@with_session
-async def add_or_update_user_bun(
-    session: AsyncSession, user_id: int, bun: str, chat_id: int
-):
-    """Добавление или обновление записи о булочке для пользователя с учетом очков."""
-    # Получаем баллы за булочку из таблицы buns
-    result = await session.execute(select(Bun).where(Bun.name == bun))
-    bun_record = result.scalar_one_or_none()
+async def award_bun(
+    session: AsyncSession,
+    user_id: int,
+    bun: str,
+    chat_id: int,
+    won_at: datetime | None = None,
+) -> UserBun | None:
+    """Начисление булочки пользователю в рамках уже открытой сессии (без commit).
+
+    Баллы берутся из buns прямо в INSERT ... SELECT, а счетчик увеличивается
+    в ON CONFLICT DO UPDATE - одним оператором, без чтения и гонок. Если такой
+    булочки нет, ничего не вставляется и возвращается None.
+    """
+    user_buns = UserBun.__table__
+    insert_stmt = sqlite_insert(UserBun).from_select(
+        ["user_id", "bun", "chat_id", "count", "points"],
+        select(
+            literal(user_id), Bun.name, literal(chat_id), literal(1), Bun.points
+        ).where(Bun.name == bun),
+    )
+    result = await session.scalars(
+        insert_stmt.on_conflict_do_update(
+            index_elements=["user_id", "bun", "chat_id"],
+            set_={
+                "count": user_buns.c.count + 1,
+                "points": (user_buns.c.count + 1) * insert_stmt.excluded.points,
+            },
+        )
+        .returning(UserBun)
+        .execution_options(populate_existing=True)
+    )
+    user_bun = result.one_or_none()
+    if user_bun is None:
+        return None
 
-    if not bun_record:
-        logger.error(f"Булочка '{bun}' не найдена в таблице buns")
-        return  # Или можно выбросить исключение, если это критично
+    logger.debug(
+        f"Начислена булочка для user_id={user_id}, bun={bun}, count={user_bun.count}, points={user_bun.points}"
+    )
+    await _upsert_scores(session, [(user_id, chat_id)], won_at)
+    return user_bun
 
-    points_per_bun = bun_record.points  # Баллы за одну булочку из базы
 
-    try:
-        # Проверяем, есть ли уже запись для этой булочки у пользователя
-        result = await session.execute(
-            select(UserBun).where(
-                UserBun.user_id == user_id,
-                UserBun.bun == bun,
-                UserBun.chat_id == chat_id,
-            )
-        )
-        user_bun = result.scalar_one_or_none()
+async def _award_buns(
+    session: AsyncSession,
+    awards: list[tuple[int, str, int, int]],
+    won_at: datetime | None = None,
+):
+    """Пакетное начисление булочек (user_id, bun, chat_id, points_per_bun) без commit.
 
-        if user_bun:
-            # Если запись существует, увеличиваем счётчик и пересчитываем очки
-            user_bun.count += 1
-            user_bun.points = user_bun.count * points_per_bun
-            logger.debug(
-                f"Обновлена запись для user_id={user_id}, bun={bun}, count={user_bun.count}, points={user_bun.points}"
-            )
-        else:
-            # Если записи нет, создаём новую
-            user_bun = UserBun(
-                user_id=user_id,
-                bun=bun,
-                chat_id=chat_id,
-                count=1,
-                points=points_per_bun,
-            )
-            session.add(user_bun)
-            logger.info(
-                f"Добавлена новая булочка '{bun}' для user_id={user_id} в чате {chat_id}"
-            )
+    Булочки и итоги user_scores обновляются двумя upsert'ами через executemany:
+    оператор компилируется один раз, а не строится заново на каждого победителя.
+    """
+    if not awards:
+        return
+    user_buns = UserBun.__table__
+    insert_stmt = sqlite_insert(user_buns)
+    # Для существующей записи: счетчик +1, очки = счетчик * баллы булочки
+    await session.execute(
+        insert_stmt.on_conflict_do_update(
+            index_elements=["user_id", "bun", "chat_id"],
+            set_={
+                "count": user_buns.c.count + 1,
+                "points": (user_buns.c.count + 1) * insert_stmt.excluded.points,
+            },
+        ),
+        [
+            {
+                "user_id": user_id,
+                "bun": bun,
+                "chat_id": chat_id,
+                "count": 1,
+                "points": points_per_bun,
+            }
+            for user_id, bun, chat_id, points_per_bun in awards
+        ],
+    )
+    await _upsert_scores(
+        session, [(user_id, chat_id) for user_id, _, chat_id, _ in awards], won_at
+    )
 
-        await session.commit()
-        return user_bun  # Можно вернуть объект для дальнейшего использования
-    except IntegrityError as e:
-        await session.rollback()
-        logger.error(
-            f"Ошибка целостности при добавлении булочки '{bun}' для user_id={user_id}: {e}"
+
+async def _upsert_scores(
+    session: AsyncSession,
+    members: list[tuple[int, int]],
+    won_at: datetime | None = None,
+):
+    """Пересчет user_scores игроков (user_id, chat_id), у которых есть булочки (без commit).
+
+    Итоги считаются в INSERT ... SELECT по user_buns и записываются upsert'ом;
+    won_at - время выигрыша Булочки Дня, без него last_win остается прежним.
+    Строку игрока без булочек удаляет тот, кто удалил его булочки.
+    """
+    user_buns = UserBun.__table__
+    totals = (
+        select(
+            user_buns.c.user_id,
+            user_buns.c.chat_id,
+            func.sum(user_buns.c.points),
+            func.sum(user_buns.c.count),
+            bindparam("won_at", won_at, type_=UserScore.last_win.type),
         )
-        raise
-    except Exception as e:
-        await session.rollback()
-        logger.error(
-            f"Неизвестная ошибка при обновлении булочки '{bun}' для user_id={user_id}: {e}"
+        .where(
+            user_buns.c.user_id == bindparam("score_user_id"),
+            user_buns.c.chat_id == bindparam("score_chat_id"),
         )
-        raise
+        .group_by(user_buns.c.user_id, user_buns.c.chat_id)
+    )
+    scores_stmt = sqlite_insert(UserScore.__table__).from_select(
+        ["user_id", "chat_id", "total_points", "total_buns", "last_win"], totals
+    )
+    await session.execute(
+        scores_stmt.on_conflict_do_update(
+            index_elements=["user_id", "chat_id"],
+            set_={
+                "total_points": scores_stmt.excluded.total_points,
+                "total_buns": scores_stmt.excluded.total_buns,
+                "last_win": func.coalesce(
+                    scores_stmt.excluded.last_win, UserScore.__table__.c.last_win
+                ),
+            },
+        ),
+        [
+            {"score_user_id": user_id, "score_chat_id": chat_id, "won_at": won_at}
+            for user_id, chat_id in members
+        ],
+    )
+    _invalidate_leaderboard(session, *{chat_id for _, chat_id in members})
 
 
 @with_session
@@ -286,53 +600,98 @@ async def get_user_buns_stats(session: AsyncSession, telegram_id: int, chat_id:
     )
 
 
-@with_session
-async def get_top_users_by_points(session: AsyncSession, chat_id: int):
-    """Получение топ-10 пользователей по очкам с их лучшей булочкой."""
-    # Подзапрос для получения максимальных очков по булочке для каждого пользователя
-    subquery = (
-        select(
-            UserBun.user_id,
-            func.max(UserBun.points).label("max_points"),
-            UserBun.bun.label("top_bun"),
-            UserBun.count.label("top_count"),
-        )
-        .where(UserBun.chat_id == chat_id)
-        .group_by(UserBun.user_id)
-        .subquery()
-    )
+async def get_top_users_by_points(chat_id: int):
+    """Получение топ-10 пользователей по сумме очков с их лучшей булочкой.
 
-    # Основной запрос: соединяем с пользователями и сортируем по очкам
-    query = (
+    Результат кэшируется по чату (leaderboard_cache) до следующего изменения
+    очков или состава игроков чата, повторный /stats не обращается к базе.
+    """
+    top_users = leaderboard_cache.get(chat_id)
+    if top_users is None:
+        version = leaderboard_cache.version
+        top_users = await _load_top_users(chat_id)
+        leaderboard_cache.set(chat_id, top_users, version=version)
+    # Копии записей: вызывающий код не испортит закэшированный топ
+    return [dict(user) for user in top_users]
+
+
+@with_session
+async def _load_top_users(session: AsyncSession, chat_id: int):
+    """Топ-10 чата из базы (без кэша)."""
+    # Топ берется из user_scores по индексу (chat_id, total_points DESC)
+    result = await session.execute(
         select(
+            User.id,
             User.username,
             User.full_name,
-            subquery.c.max_points,
-            subquery.c.top_bun,
-            subquery.c.top_count,
+            UserScore.total_points,
+            UserScore.total_buns,
         )
-        .join(subquery, User.id == subquery.c.user_id)
-        .where(User.chat_id == chat_id, User.in_game == True)
-        .order_by(subquery.c.max_points.desc())
+        .join(User, User.id == UserScore.user_id)
+        .where(UserScore.chat_id == chat_id, User.in_game == True)
+        .order_by(UserScore.total_points.desc())
         .limit(10)
     )
-
-    result = await session.execute(query)
     top_users = result.fetchall()
-    return (
-        [
-            {
-                "username": username,
-                "full_name": full_name,
-                "points": max_points,
-                "bun": top_bun,
-                "count": top_count,
-            }
-            for username, full_name, max_points, top_bun, top_count in top_users
-        ]
-        if top_users
-        else []
+    if not top_users:
+        return []
+
+    # Лучшая булочка - только для десяти игроков из топа
+    result = await session.execute(
+        select(UserBun.user_id, UserBun.bun, UserBun.count, UserBun.points).where(
+            UserBun.chat_id == chat_id,
+            UserBun.user_id.in_([user_id for user_id, *_ in top_users]),
+        )
+    )
+    best_buns = {}
+    for user_id, bun, count, points in result.fetchall():
+        best = best_buns.get(user_id)
+        if best is None or points > best[2]:
+            best_buns[user_id] = (bun, count, points)
+
+    return [
+        {
+            "username": username,
+            "full_name": full_name,
+            "points": total_points,
+            "total_buns": total_buns,
+            "bun": best_buns.get(user_id, (None, 0))[0],
+            "count": best_buns.get(user_id, (None, 0))[1],
+        }
+        for user_id, username, full_name, total_points, total_buns in top_users
+    ]
+
+
+@with_session
+async def get_user_score(session: AsyncSession, telegram_id: int, chat_id: int):
+    """Итоги игрока в чате и его место среди активных игроков (или None)."""
+    result = await session.execute(
+        select(UserScore.total_points, UserScore.total_buns, UserScore.last_win)
+        .join(User, User.id == UserScore.user_id)
+        .where(User.telegram_id == telegram_id, UserScore.chat_id == chat_id)
+    )
+    score = result.first()
+    if not score:
+        return None
+    total_points, total_buns, last_win = score
+
+    # Место = число игроков с большей суммой + 1 (диапазон по индексу)
+    result = await session.execute(
+        select(func.count())
+        .select_from(UserScore)
+        .join(User, User.id == UserScore.user_id)
+        .where(
+            UserScore.chat_id == chat_id,
+            UserScore.total_points > total_points,
+            User.in_game == True,
+        )
     )
+    return {
+        "total_points": total_points,
+        "total_buns": total_buns,
+        "last_win": last_win,
+        "rank": result.scalar() + 1,
+    }
 
 
 @with_session
@@ -356,6 +715,119 @@ async def get_all_users(session: AsyncSession):
     ]
 
 
+# Порядки сортировки участников чата; telegram_id уникален и замыкает ключ пагинации
+CHAT_MEMBER_ORDERS = {
+    "telegram_id": (User.telegram_id,),
+    "full_name": (User.full_name, User.telegram_id),
+}
+
+
+def _member_dict(row) -> dict:
+    telegram_id, username, full_name, chat_id, in_game = row
+    return {
+        "telegram_id": telegram_id,
+        "username": username,
+        "full_name": full_name,
+        "chat_id": chat_id,
+        "in_game": in_game,
+    }
+
+
+async def _keyset_condition(
+    session: AsyncSession, columns: tuple, cursor: int, forward: bool
+):
+    """Условие "строго после/до пользователя cursor" в порядке columns.
+
+    Курсором служит только telegram_id - он помещается в callback_data кнопки;
+    значения ключа курсора читаются одним запросом, а сравнение строк
+    (full_name, telegram_id) > (...) SQLite выполняет поиском по диапазону
+    ix_users_chat_name. Если курсора уже нет в базе, условие ложно.
+    """
+    values = (
+        await session.execute(select(*columns).where(User.telegram_id == cursor))
+    ).first()
+    if values is None:
+        return false()
+    key, bound = tuple_(*columns), tuple_(*values)
+    return key > bound if forward else key < bound
+
+
+@with_session
+async def get_chat_members(
+    session: AsyncSession,
+    chat_id: int,
+    in_game: bool | None = True,
+    order_by: str = "telegram_id",
+    after: int | None = None,
+    before: int | None = None,
+    limit: int | None = None,
+) -> list[dict]:
+    """Участники чата в порядке order_by с keyset-пагинацией.
+
+    in_game=None - все участники независимо от статуса. after/before - telegram_id
+    последнего (первого) пользователя соседней страницы: возвращаются limit
+    пользователей следом за ним (перед ним), всегда в прямом порядке.
+    """
+    columns = CHAT_MEMBER_ORDERS[order_by]
+    query = select(
+        User.telegram_id, User.username, User.full_name, User.chat_id, User.in_game
+    ).where(User.chat_id == chat_id)
+    if in_game is not None:
+        query = query.where(User.in_game == in_game)
+    if after is not None:
+        query = query.where(
+            await _keyset_condition(session, columns, after, forward=True)
+        )
+    if before is not None:
+        query = query.where(
+            await _keyset_condition(session, columns, before, forward=False)
+        )
+        # Страница "назад": берем ближайшие к курсору строки и разворачиваем
+        query = query.order_by(*[column.desc() for column in columns])
+    else:
+        query = query.order_by(*columns)
+    if limit is not None:
+        query = query.limit(limit)
+
+    rows = (await session.execute(query)).fetchall()
+    if before is not None:
+        rows.reverse()
+    return [_member_dict(row) for row in rows]
+
+
+@with_session
+async def count_chat_members(
+    session: AsyncSession,
+    chat_id: int,
+    in_game: bool | None = True,
+    before: int | None = None,
+    order_by: str = "telegram_id",
+) -> int:
+    """Количество участников чата; с before - только стоящих раньше этого пользователя."""
+    query = select(func.count(User.id)).where(User.chat_id == chat_id)
+    if in_game is not None:
+        query = query.where(User.in_game == in_game)
+    if before is not None:
+        query = query.where(
+            await _keyset_condition(
+                session, CHAT_MEMBER_ORDERS[order_by], before, forward=False
+            )
+        )
+    return (await session.execute(query)).scalar() or 0
+
+
+@with_session
+async def get_chat_member(session: AsyncSession, chat_id: int, telegram_id: int):
+    """Участник чата по telegram_id (в том же виде, что get_chat_members) или None."""
+    result = await session.execute(
+        select(
+            User.telegram_id, User.username, User.full_name, User.chat_id, User.in_game
+        ).where(User.chat_id == chat_id, User.telegram_id == telegram_id)
+    )
+    row = result.first()
+    return _member_dict(row) if row else None
+
+
 @with_session
 async def remove_user_from_game(session: AsyncSession, telegram_id: int, chat_id: int):
     """Удаление пользователя из розыгрыша (установка in_game=False)."""
@@ -365,6 +837,8 @@ async def remove_user_from_game(session: AsyncSession, telegram_id: int, chat_id
     user = result.scalars().first()
     if user and user.in_game:
         user.in_game = False
+        _invalidate_leaderboard(session, chat_id)
+        _invalidate_membership(session, (telegram_id, chat_id))
         await session.commit()
         return True
     return False
@@ -379,6 +853,23 @@ async def get_active_chat_ids(session: AsyncSession):
     return [row[0] for row in result.fetchall()]
 
 
+async def _load_bun_catalog(session: AsyncSession) -> BunCatalog:
+    """Снимок каталога булочек из памяти; из базы читается только после его сброса."""
+    catalog = bun_catalog.current
+    if catalog is None:
+        version = bun_catalog.version
+        result = await session.execute(select(Bun.name, Bun.points, Bun.weight))
+        catalog = bun_catalog.publish(BunCatalog(result.fetchall()), version)
+        logger.debug(f"Каталог булочек загружен: {len(catalog.points)} шт.")
+    return catalog
+
+
+@with_session
+async def get_bun_catalog(session: AsyncSession) -> BunCatalog:
+    """Каталог булочек с весами редкости и вероятностями выпадения."""
+    return await _load_bun_catalog(session)
+
+
 @with_session
 async def get_all_buns(session: AsyncSession):
     """Получение всех булочек из таблицы buns."""
@@ -390,13 +881,14 @@ async def get_all_buns(session: AsyncSession):
 
 
 @with_session
-async def add_bun(session: AsyncSession, name: str, points: int):
-    """Добавление новой булочки в таблицу buns."""
+async def add_bun(session: AsyncSession, name: str, points: int, weight: int = 1):
+    """Добавление новой булочки в таблицу buns (weight - вес редкости)."""
     try:
-        bun = Bun(name=name, points=points)
+        bun = Bun(name=name, points=points, weight=weight)
         session.add(bun)
+        _invalidate_after_commit(session, bun_catalog)
         await session.commit()
-        logger.info(f"Добавлена булочка: {name} ({points} баллов)")
+        logger.info(f"Добавлена булочка: {name} ({points} баллов, вес {weight})")
         return bun  # Возвращаем объект Bun для подтверждения
     except IntegrityError:
         await session.rollback()
@@ -405,14 +897,19 @@ async def add_bun(session: AsyncSession, name: str, points: int):
 
 
 @with_session
-async def edit_bun(session: AsyncSession, name: str, points: int):
-    """Редактирование баллов существующей булочки."""
+async def edit_bun(
+    session: AsyncSession, name: str, points: int, weight: int | None = None
+):
+    """Редактирование баллов (и, если передан, веса редкости) существующей булочки."""
     bun = await session.execute(select(Bun).where(Bun.name == name))
     bun = bun.scalar_one_or_none()
     if bun:
         bun.points = points
+        if weight is not None:
+            bun.weight = weight
+        _invalidate_after_commit(session, bun_catalog)
         await session.commit()
-        logger.info(f"Обновлена булочка: {name} ({points} баллов)")
+        logger.info(f"Обновлена булочка: {name} ({points} баллов, вес {bun.weight})")
         return bun
     logger.warning(f"Булочка '{name}' не найдена для редактирования")
     return None
@@ -425,6 +922,7 @@ async def remove_bun(session: AsyncSession, name: str):
     bun = bun.scalar_one_or_none()
     if bun:
         await session.delete(bun)
+        _invalidate_after_commit(session, bun_catalog)
         await session.commit()
         logger.info(f"Удалена булочка: {name}")
         return True
@@ -432,41 +930,22 @@ async def remove_bun(session: AsyncSession, name: str):
     return False
 
 
-@with_session
-async def get_user_points(session: AsyncSession, telegram_id: int, chat_id: int) -> int:
-    """Получает сумму баллов пользователя из user_buns."""
-    query = (
-        select(func.sum(UserBun.points).label("total_points"))
-        .join(User, User.id == UserBun.user_id)
-        .where(User.telegram_id == telegram_id, UserBun.chat_id == chat_id)
-    )
-    result = await session.execute(query)
-    total_points = result.scalar() or 0
-    return total_points
-
-
-@with_session
-async def update_user_points(
-    session: AsyncSession, telegram_id: int, chat_id: int, new_points: int
-):
-    """Обновляет баллы пользователя в user_buns, распределяя новые очки по булочкам с 0 или равномерно."""
-    # Получаем пользователя
-    user = await get_user_by_id(telegram_id, chat_id)
-    if not user:
-        logger.warning(
-            f"Пользователь telegram_id={telegram_id} не найден в чате {chat_id}"
-        )
-        return
+async def distribute_points(
+    session: AsyncSession, user_id: int, chat_id: int, new_points: int
+) -> int | None:
+    """Распределение new_points по булочкам игрока в рамках открытой сессии (без commit).
 
+    Возвращает новый итог очков или None, если булочек у игрока нет.
+    """
     # Получаем все записи user_buns для пользователя
     result = await session.execute(
-        select(UserBun).where(UserBun.user_id == user.id, UserBun.chat_id == chat_id)
+        select(UserBun).where(UserBun.user_id == user_id, UserBun.chat_id == chat_id)
     )
     user_buns = result.scalars().all()
 
     if not user_buns:
         logger.warning(
-            f"Нет записей user_buns для telegram_id={telegram_id}, chat_id={chat_id}"
+            f"Нет записей user_buns для user_id={user_id}, chat_id={chat_id}"
         )
         return
 
@@ -504,10 +983,12 @@ async def update_user_points(
                 bun.points -= loss
                 remaining_loss -= loss
 
-    await session.commit()
+    await session.flush()
+    await _upsert_scores(session, [(user_id, chat_id)])
     logger.debug(
-        f"Обновлены баллы для telegram_id={telegram_id}, chat_id={chat_id}: {new_points} добавлено, итого {new_total}"
+        f"Обновлены баллы для user_id={user_id}, chat_id={chat_id}: {new_points} добавлено, итого {new_total}"
     )
+    return new_total
 
 
 @with_session
@@ -549,90 +1030,55 @@ async def update_game_setting(session: AsyncSession, key: str, value: int) -> bo
     return False
 
 
-@with_session
-async def get_user_id_by_telegram_id(
-    session: AsyncSession, telegram_id: int, chat_id: int
-):
-    """Получение user_id по telegram_id и chat_id."""
-    result = await session.execute(
-        select(User.id).where(User.telegram_id == telegram_id, User.chat_id == chat_id)
+async def delete_member_rows(session: AsyncSession, telegram_id: int, chat_id: int) -> bool:
+    """Полное удаление пользователя из всех таблиц в рамках открытой сессии (без commit)."""
+    # Получаем пользователя для получения его внутреннего ID
+    user_result = await session.execute(
+        select(User).where(User.telegram_id == telegram_id, User.chat_id == chat_id)
     )
-    user_id = result.scalar()
-    return user_id
-
-
-@with_session
-async def delete_user_buns(session: AsyncSession, telegram_id: int, chat_id: int):
-    """Удаление всех булок пользователя."""
-    user_id = await get_user_id_by_telegram_id(telegram_id, chat_id)
-    if user_id:
-        await session.execute(
-            delete(UserBun).where(
-                UserBun.user_id == user_id, UserBun.chat_id == chat_id
-            )
-        )
-        await session.commit()
-
-
-@with_session
-async def reset_user_on_zero_points(
-    session: AsyncSession, telegram_id: int, chat_id: int
-):
-    """Полное удаление булок пользователя при достижении 0 баллов."""
-    await delete_user_buns(telegram_id, chat_id)  # Теперь передаем session
+    user = user_result.scalar_one_or_none()
 
+    if not user:
+        logger.warning(f"Пользователь telegram_id={telegram_id} не найден в чате {chat_id}")
+        return False
 
-@with_session
-async def delete_user_completely(session: AsyncSession, telegram_id: int, chat_id: int):
-    """Полное удаление пользователя из всех таблиц базы данных."""
-    try:
-        # Получаем пользователя для получения его внутреннего ID
-        user_result = await session.execute(
-            select(User).where(User.telegram_id == telegram_id, User.chat_id == chat_id)
+    user_id = user.id
+    display_name = f"@{user.username}" if user.username else user.full_name
+    
+    # 1. Удаляем все булочки пользователя
+    await session.execute(
+        delete(UserBun).where(
+            UserBun.user_id == user_id, 
+            UserBun.chat_id == chat_id
         )
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            logger.warning(f"Пользователь telegram_id={telegram_id} не найден в чате {chat_id}")
-            return False
-        
-        user_id = user.id
-        display_name = f"@{user.username}" if user.username else user.full_name
-        
-        # 1. Удаляем все булочки пользователя
-        await session.execute(
-            delete(UserBun).where(
-                UserBun.user_id == user_id, 
-                UserBun.chat_id == chat_id
-            )
+    )
+    await session.execute(
+        delete(UserScore).where(
+            UserScore.user_id == user_id, UserScore.chat_id == chat_id
         )
-        logger.debug(f"Удалены все булочки для пользователя {display_name}")
-        
-        # 2. Удаляем все записи о ежедневном выборе
-        await session.execute(
-            delete(DailySelection).where(
-                DailySelection.user_id == user_id,
-                DailySelection.chat_id == chat_id
-            )
+    )
+    _invalidate_leaderboard(session, chat_id)
+    _invalidate_membership(session, (telegram_id, chat_id))
+    logger.debug(f"Удалены все булочки для пользователя {display_name}")
+    
+    # 2. Удаляем все записи о ежедневном выборе
+    await session.execute(
+        delete(DailySelection).where(
+            DailySelection.user_id == user_id,
+            DailySelection.chat_id == chat_id
         )
-        logger.debug(f"Удалены все записи ежедневного выбора для пользователя {display_name}")
-        
-        # 3. Удаляем самого пользователя
-        await session.execute(
-            delete(User).where(
-                User.telegram_id == telegram_id,
-                User.chat_id == chat_id
-            )
+    )
+    logger.debug(f"Удалены все записи ежедневного выбора для пользователя {display_name}")
+    
+    # 3. Удаляем самого пользователя
+    await session.execute(
+        delete(User).where(
+            User.telegram_id == telegram_id,
+            User.chat_id == chat_id
         )
-        logger.info(f"Полностью удален пользователь {display_name} (ID: {telegram_id}) из чата {chat_id}")
-        
-        await session.commit()
-        return True
-        
-    except Exception as e:
-        await session.rollback()
-        logger.error(f"Ошибка при полном удалении пользователя {telegram_id} из чата {chat_id}: {e}")
-        raise
+    )
+    logger.info(f"Полностью удален пользователь {display_name} (ID: {telegram_id}) из чата {chat_id}")
+    return True
 
 
 @with_session
@@ -649,6 +1095,18 @@ async def get_inactive_users_count(session: AsyncSession):
         return 0
 
 
+@with_session
+async def get_inactive_users_summary(session: AsyncSession) -> dict[int, int]:
+    """Количество неактивных пользователей по чатам одним агрегирующим запросом."""
+    result = await session.execute(
+        select(User.chat_id, func.count(User.id))
+        .where(User.in_game == False)
+        .group_by(User.chat_id)
+        .order_by(User.chat_id)
+    )
+    return {chat_id: count for chat_id, count in result.fetchall()}
+
+
 @with_session
 async def get_inactive_users_by_chat(session: AsyncSession):
     """Получение неактивных пользователей, сгруппированных по чатам."""
@@ -679,77 +1137,77 @@ async def get_inactive_users_by_chat(session: AsyncSession):
 
 @with_session
 async def bulk_delete_inactive_users(session: AsyncSession):
-    """Массовое удаление всех неактивных пользователей из всех таблиц."""
+    """Массовое удаление всех неактивных пользователей из всех таблиц.
+
+    Удаление идет DELETE по множеству для каждой таблицы (без цикла по пользователям).
+    Возвращает (удалено, {chat_id: {"count": n, "sample": [до 3 имен]}}).
+    """
     try:
-        # Получаем всех неактивных пользователей
+        # Сводка по чатам одним запросом: количество и первые три имени
+        display_name = case(
+            (
+                and_(User.username.is_not(None), User.username != ""),
+                literal("@") + User.username,
+            ),
+            else_=User.full_name,
+        )
+        ranked = (
+            select(
+                User.chat_id,
+                display_name.label("display_name"),
+                func.row_number()
+                .over(partition_by=User.chat_id, order_by=User.telegram_id)
+                .label("rn"),
+                func.count().over(partition_by=User.chat_id).label("total"),
+            )
+            .where(User.in_game == False)
+            .subquery()
+        )
         result = await session.execute(
-            select(User).where(User.in_game == False)
+            select(ranked.c.chat_id, ranked.c.display_name, ranked.c.total)
+            .where(ranked.c.rn <= 3)
+            .order_by(ranked.c.chat_id, ranked.c.rn)
         )
-        inactive_users = result.scalars().all()
-        
-        if not inactive_users:
+        deleted_by_chat = {}
+        for chat_id, name, total in result.fetchall():
+            chat = deleted_by_chat.setdefault(chat_id, {"count": total, "sample": []})
+            chat["sample"].append(name)
+
+        if not deleted_by_chat:
             logger.info("Нет неактивных пользователей для удаления")
             return 0, {}
-        
-        deleted_count = 0
-        deleted_by_chat = {}
-        
-        for user in inactive_users:
-            user_id = user.id
-            chat_id = user.chat_id
-            telegram_id = user.telegram_id
-            display_name = f"@{user.username}" if user.username else user.full_name
-            
-            try:
-                # 1. Удаляем все булочки пользователя
-                await session.execute(
-                    delete(UserBun).where(
-                        UserBun.user_id == user_id,
-                        UserBun.chat_id == chat_id
-                    )
-                )
-                
-                # 2. Удаляем все записи о ежедневном выборе
-                await session.execute(
-                    delete(DailySelection).where(
-                        DailySelection.user_id == user_id,
-                        DailySelection.chat_id == chat_id
-                    )
-                )
-                
-                # 3. Удаляем самого пользователя
-                await session.execute(
-                    delete(User).where(
-                        User.id == user_id,
-                        User.chat_id == chat_id
-                    )
-                )
-                
-                # Добавляем в статистику
-                if chat_id not in deleted_by_chat:
-                    deleted_by_chat[chat_id] = []
-                deleted_by_chat[chat_id].append({
-                    "telegram_id": telegram_id,
-                    "display_name": display_name
-                })
-                
-                deleted_count += 1
-                logger.debug(f"Удален неактивный пользователь {display_name} из чата {chat_id}")
-                
-            except Exception as user_error:
-                logger.error(f"Ошибка при удалении пользователя {display_name}: {user_error}")
-                continue
-        
+
+        inactive_ids = select(User.id).where(User.in_game == False)
+        _invalidate_leaderboard(session, *deleted_by_chat)
+        # Удаленных пользователей по одному не перечисляем - сбрасываем кэш целиком
+        _invalidate_membership(session)
+
+        # 1. Удаляем все булочки и итоги неактивных пользователей
+        await session.execute(
+            delete(UserBun).where(UserBun.user_id.in_(inactive_ids))
+        )
+        await session.execute(
+            delete(UserScore).where(UserScore.user_id.in_(inactive_ids))
+        )
+        # 2. Удаляем все записи о ежедневном выборе
+        await session.execute(
+            delete(DailySelection).where(DailySelection.user_id.in_(inactive_ids))
+        )
+        # 3. Удаляем самих пользователей
+        result = await session.execute(delete(User).where(User.in_game == False))
+        deleted_count = result.rowcount
+
         await session.commit()
         logger.info(f"Массовое удаление завершено: удалено {deleted_count} неактивных пользователей")
-        
+
         return deleted_count, deleted_by_chat
-        
+
     except Exception as e:
         await session.rollback()
         logger.error(f"Ошибка при массовом удалении неактивных пользователей: {e}")
         raise
 
+
 @with_session
 async def update_user_username(session: AsyncSession, telegram_id: int, new_username: str | None):
     """Обновление username пользователя по telegram_id."""
@@ -762,10 +1220,244 @@ async def update_user_username(session: AsyncSession, telegram_id: int, new_user
             # Обновляем только если username изменился
             if user.username != new_username:
                 user.username = new_username
+                _invalidate_leaderboard(session, user.chat_id)
+                _invalidate_membership(session, (telegram_id, user.chat_id))
                 await session.commit()
                 return True
         return False
     except Exception as e:
         await session.rollback()
         logger.error(f"Ошибка при обновлении username для {telegram_id}: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+@with_session
+async def enqueue_broadcast(
+    session: AsyncSession,
+    broadcast: str,
+    chat_ids: list[int],
+    kind: str,
+    payload: str | None = None,
+    payloads: dict[int, str] | None = None,
+) -> int:
+    """Постановка рассылки в outbox: одна строка на чат, повторная постановка игнорируется.
+
+    payloads задает содержимое для отдельных чатов вместо общего payload.
+    """
+    added = await _insert_outbox(session, broadcast, chat_ids, kind, payload, payloads)
+    await session.commit()
+    return added
+
+
+async def _insert_outbox(
+    session: AsyncSession,
+    broadcast: str,
+    chat_ids: list[int],
+    kind: str,
+    payload: str | None = None,
+    payloads: dict[int, str] | None = None,
+) -> int:
+    """Вставка строк рассылки в outbox в рамках открытой сессии (без commit)."""
+    payloads = payloads or {}
+    now = clock.now()
+    rows = [
+        {
+            "broadcast": broadcast,
+            "chat_id": chat_id,
+            "kind": kind,
+            "payload": payloads.get(chat_id, payload),
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now,
+        }
+        for chat_id in chat_ids
+    ]
+    added = 0
+    # Вставляем пачками, чтобы не упереться в лимит параметров SQLite
+    for i in range(0, len(rows), 100):
+        stmt = (
+            sqlite_insert(OutboxMessage)
+            .values(rows[i : i + 100])
+            .on_conflict_do_nothing(index_elements=["broadcast", "chat_id"])
+        )
+        result = await session.execute(stmt)
+        added += result.rowcount
+    logger.info(f"Рассылка {broadcast}: в outbox добавлено {added} из {len(rows)} чатов")
+    return added
+
+
+@with_session
+async def get_broadcast_chat_ids(session: AsyncSession, broadcast: str) -> set[int]:
+    """Чаты, уже поставленные в outbox для рассылки."""
+    result = await session.execute(
+        select(OutboxMessage.chat_id).where(OutboxMessage.broadcast == broadcast)
+    )
+    return set(result.scalars().all())
+
+
+@with_session
+async def get_due_outbox(
+    session: AsyncSession, broadcast: str | None = None, limit: int = 5000
+):
+    """Получение сообщений outbox, которые пора доставить."""
+    query = select(OutboxMessage).where(
+        OutboxMessage.status == "pending",
+        OutboxMessage.next_attempt_at <= clock.now(),
+    )
+    if broadcast is not None:
+        query = query.where(OutboxMessage.broadcast == broadcast)
+    result = await session.execute(query.order_by(OutboxMessage.id).limit(limit))
+    return [
+        {
+            "id": row.id,
+            "broadcast": row.broadcast,
+            "chat_id": row.chat_id,
+            "kind": row.kind,
+            "payload": row.payload,
+            "attempts": row.attempts,
+        }
+        for row in result.scalars().all()
+    ]
+
+
+@with_session
+async def claim_outbox_message(
+    session: AsyncSession, outbox_id: int, sending_timeout: int
+) -> bool:
+    """Захват сообщения outbox перед отправкой: True, если его захватили именно мы.
+
+    Строка переходит из pending в sending одним UPDATE, поэтому отправить ее
+    может только один доставщик, даже если он читал устаревший снимок.
+    Если доставщик упал, после sending_timeout секунд строка вернется в очередь.
+    """
+    result = await session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id == outbox_id, OutboxMessage.status == "pending")
+        .values(
+            status="sending",
+            next_attempt_at=clock.now() + timedelta(seconds=sending_timeout),
+        )
+    )
+    await session.commit()
+    return result.rowcount == 1
+
+
+@with_session
+async def requeue_stale_outbox(session: AsyncSession) -> int:
+    """Возврат в очередь сообщений, захваченных доставщиком, который так и не отчитался."""
+    result = await session.execute(
+        update(OutboxMessage)
+        .where(
+            OutboxMessage.status == "sending",
+            OutboxMessage.next_attempt_at <= clock.now(),
+        )
+        .values(status="pending")
+    )
+    await session.commit()
+    if result.rowcount:
+        logger.warning(f"Outbox: {result.rowcount} зависших сообщений возвращено в очередь")
+    return result.rowcount
+
+
+@with_session
+async def mark_outbox_delivered(session: AsyncSession, outbox_id: int):
+    """Отметка о доставке сообщения outbox."""
+    await session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id == outbox_id)
+        .values(status="delivered", delivered_at=clock.now())
+    )
+    await session.commit()
+
+
+@with_session
+async def mark_outbox_failed(
+    session: AsyncSession, outbox_id: int, error: str, retry_at: datetime | None
+):
+    """Неудачная попытка доставки: откладываем до retry_at или окончательно помечаем failed."""
+    await session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id == outbox_id)
+        .values(
+            status="pending" if retry_at else "failed",
+            attempts=OutboxMessage.attempts + 1,
+            next_attempt_at=retry_at or clock.now(),
+            last_error=error[:500],
+        )
+    )
+    await session.commit()
+
+
+@with_session
+async def expire_outbox(session: AsyncSession, older_than: datetime) -> int:
+    """Отмена недоставленных сообщений, поставленных в очередь раньше older_than."""
+    result = await session.execute(
+        update(OutboxMessage)
+        .where(
+            OutboxMessage.status == "pending",
+            OutboxMessage.created_at < older_than,
+        )
+        .values(status="failed", last_error="expired")
+    )
+    await session.commit()
+    if result.rowcount:
+        logger.warning(f"Outbox: {result.rowcount} устаревших сообщений отменено")
+    return result.rowcount
+
+
+@with_session
+async def get_job_last_runs(session: AsyncSession) -> dict[str, datetime]:
+    """Время последнего успешного запуска каждой задачи по расписанию."""
+    result = await session.execute(select(JobRun.job, JobRun.last_success_at))
+    return {job: last_success_at for job, last_success_at in result.fetchall()}
+
+
+@with_session
+async def record_job_run(session: AsyncSession, job: str, finished_at: datetime):
+    """Запись успешного запуска задачи по расписанию."""
+    stmt = sqlite_insert(JobRun).values(job=job, last_success_at=finished_at)
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["job"],
+            set_={"last_success_at": stmt.excluded.last_success_at},
+        )
+    )
+    await session.commit()
+
+
+@with_session
+async def try_acquire_lease(
+    session: AsyncSession, name: str, holder: str, ttl_seconds: float
+) -> bool:
+    """Захват или продление аренды: удается владельцу или если аренда истекла."""
+    now = clock.now()
+    stmt = sqlite_insert(Lease).values(
+        name=name,
+        holder=holder,
+        expires_at=now + timedelta(seconds=ttl_seconds),
+        heartbeat_at=now,
+    )
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["name"],
+            set_={
+                "holder": stmt.excluded.holder,
+                "expires_at": stmt.excluded.expires_at,
+                "heartbeat_at": stmt.excluded.heartbeat_at,
+            },
+            where=(Lease.holder == holder) | (Lease.expires_at < now),
+        )
+    )
+    result = await session.execute(select(Lease.holder).where(Lease.name == name))
+    await session.commit()
+    return result.scalar() == holder
+
+
+@with_session
+async def release_lease(session: AsyncSession, name: str, holder: str):
+    """Освобождение аренды, если она принадлежит holder."""
+    await session.execute(
+        delete(Lease).where(Lease.name == name, Lease.holder == holder)
+    )
+    await session.commit()
@@ -1,5 +1,3 @@
-import asyncio
-
 from aiogram import Router, types, F
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
@@ -7,22 +5,32 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQu
 from config import ADMIN
 from database.queries import (
     get_all_users,
+    get_chat_members,
+    get_chat_member,
+    count_chat_members,
     update_user_username,
     remove_user_from_game,
-    delete_user_completely,
     get_all_buns,
+    get_bun_catalog,
     remove_bun,
     edit_bun,
     add_bun,
     get_inactive_users_count,
     get_inactive_users_by_chat,
+    get_inactive_users_summary,
     bulk_delete_inactive_users,
 )
 from handlers.in_game import pluralize_points
+from services.game import apply_points_delta, delete_member, set_points_total
 from collections import defaultdict
+from utils import clock
 
 from handlers.random_user import send_random_message
 from handlers.evening_humor import send_evening_humor, get_evening_schedule_info
+from handlers.outbox import deliver_broadcast, enqueue_daily_bun
+from database.db import SQLITE_CHECKPOINT_INTERVAL, get_sqlite_settings
+from utils.cache import leaderboard_cache, membership_cache
+from utils.retry import retry_stats
 
 admin_cntr = Router()
 
@@ -219,6 +227,12 @@ async def admin_other_menu(callback: CallbackQuery):
                     callback_data="cmd_evening_schedule_status",
                 )
             ],
+            [
+                InlineKeyboardButton(
+                    text="🗄 Настройки базы данных",
+                    callback_data="cmd_db_settings",
+                )
+            ],
             [
                 InlineKeyboardButton(
                     text="⬅️ Назад в главное меню", callback_data="back_to_main"
@@ -432,7 +446,7 @@ async def refresh_usernames_handler(callback: CallbackQuery):
             # 2. Проверка на наличие username
             if not actual_username:
                 # Если у пользователя нет юзернейма - удаляем
-                await delete_user_completely(telegram_id=telegram_id, chat_id=chat_id)
+                await delete_member(telegram_id=telegram_id, chat_id=chat_id)
                 deleted_no_username.append(
                     f"{display_name} (Имя: {chat_member.user.full_name})"
                 )
@@ -454,19 +468,16 @@ async def refresh_usernames_handler(callback: CallbackQuery):
         except Exception as e:
             # 4. Обработка ошибки доступа (бот не видит юзера, юзер забанил бота, чат недоступен)
             try:
-                await delete_user_completely(telegram_id=telegram_id, chat_id=chat_id)
+                await delete_member(telegram_id=telegram_id, chat_id=chat_id)
                 deleted_access_error.append(
                     f"{display_name} (Чат: {chat_id}) - {str(e)[:30]}..."
                 )
             except Exception:
                 pass
 
+        # Темп запросов к API ограничивает общий лимитер сессии бота
         checked_count += 1
 
-        # Пауза каждые 10 проверок, чтобы не получить FloodWait
-        if checked_count % 10 == 0:
-            await asyncio.sleep(0.5)
-
     # === Формирование отчета ===
     report = f"✅ <b>Ревизия завершена!</b>\n"
     report += f"👥 Всего проверено: {checked_count}\n\n"
@@ -514,18 +525,23 @@ async def callback_remove_select_user(callback: CallbackQuery):
         await callback.answer("❌ Доступ запрещен", show_alert=True)
         return
 
-    # Парсим callback_data: remove_select_chat_{chat_id} или remove_select_chat_{chat_id}_page_{page}
+    # Парсим callback_data: remove_select_chat_{chat_id} или
+    # remove_select_chat_{chat_id}_{a|b}_{telegram_id} - страница
+    # после (a) или перед (b) пользователем telegram_id
     parts = callback.data.split("_")
     chat_id = int(parts[3])
-    page = 0
-    if len(parts) > 4 and parts[4] == "page":
-        page = int(parts[5])
+    after = before = None
+    if len(parts) > 5:
+        if parts[4] == "a":
+            after = int(parts[5])
+        elif parts[4] == "b":
+            before = int(parts[5])
 
-    # Получаем пользователей из этого чата
-    users = await get_all_users()
-    chat_users = [u for u in users if u["chat_id"] == chat_id and u["in_game"]]
+    # Пагинация: показываем по 15 пользователей на странице
+    USERS_PER_PAGE = 15
+    total_users = await count_chat_members(chat_id)
 
-    if not chat_users:
+    if not total_users:
         await callback.message.edit_text(
             f"❌ В чате {chat_id} нет активных игроков.",
             reply_markup=InlineKeyboardMarkup(
@@ -549,21 +565,25 @@ async def callback_remove_select_user(callback: CallbackQuery):
     except:
         chat_title = f"Чат {chat_id}"
 
-    # Пагинация: показываем по 15 пользователей на странице
-    USERS_PER_PAGE = 15
-    sorted_users = sorted(chat_users, key=lambda x: x["full_name"])
-    total_users = len(sorted_users)
     total_pages = (total_users + USERS_PER_PAGE - 1) // USERS_PER_PAGE
 
-    # Проверяем корректность страницы
-    if page < 0:
-        page = 0
-    if page >= total_pages:
-        page = total_pages - 1
+    # Загружаем только текущую страницу по ключу (full_name, telegram_id)
+    page_users = await get_chat_members(
+        chat_id, order_by="full_name", after=after, before=before, limit=USERS_PER_PAGE
+    )
+    if not page_users:
+        # Соседняя страница опустела (игроков удалили) - начинаем с первой
+        page_users = await get_chat_members(
+            chat_id, order_by="full_name", limit=USERS_PER_PAGE
+        )
 
-    start_idx = page * USERS_PER_PAGE
-    end_idx = min(start_idx + USERS_PER_PAGE, total_users)
-    page_users = sorted_users[start_idx:end_idx]
+    # Номер первой строки считаем по ключу, а не по номеру страницы:
+    # список мог измениться, пока админ листал
+    start_idx = await count_chat_members(
+        chat_id, before=page_users[0]["telegram_id"], order_by="full_name"
+    )
+    end_idx = start_idx + len(page_users)
+    page = min(start_idx // USERS_PER_PAGE, total_pages - 1)
 
     # Создаем кнопки для выбора пользователя
     keyboard_rows = []
@@ -581,11 +601,14 @@ async def callback_remove_select_user(callback: CallbackQuery):
     # Добавляем кнопки навигации, если страниц больше одной
     if total_pages > 1:
         nav_buttons = []
-        if page > 0:
+        if start_idx > 0:
             nav_buttons.append(
                 InlineKeyboardButton(
                     text="⬅️ Назад",
-                    callback_data=f"remove_select_chat_{chat_id}_page_{page - 1}",
+                    callback_data=(
+                        f"remove_select_chat_{chat_id}"
+                        f"_b_{page_users[0]['telegram_id']}"
+                    ),
                 )
             )
         nav_buttons.append(
@@ -594,11 +617,14 @@ async def callback_remove_select_user(callback: CallbackQuery):
                 callback_data="noop",
             )
         )
-        if page < total_pages - 1:
+        if end_idx < total_users:
             nav_buttons.append(
                 InlineKeyboardButton(
                     text="Вперёд ➡️",
-                    callback_data=f"remove_select_chat_{chat_id}_page_{page + 1}",
+                    callback_data=(
+                        f"remove_select_chat_{chat_id}"
+                        f"_a_{page_users[-1]['telegram_id']}"
+                    ),
                 )
             )
         keyboard_rows.append(nav_buttons)
@@ -637,12 +663,7 @@ async def callback_remove_confirm(callback: CallbackQuery):
     telegram_id = int(parts[3])
 
     # Получаем информацию о пользователе
-    users = await get_all_users()
-    target_user = None
-    for user in users:
-        if user["chat_id"] == chat_id and user["telegram_id"] == telegram_id:
-            target_user = user
-            break
+    target_user = await get_chat_member(chat_id, telegram_id)
 
     if not target_user:
         await callback.message.edit_text(
@@ -668,7 +689,7 @@ async def callback_remove_confirm(callback: CallbackQuery):
     )
 
     try:
-        deleted = await delete_user_completely(telegram_id=telegram_id, chat_id=chat_id)
+        deleted = await delete_member(telegram_id=telegram_id, chat_id=chat_id)
 
         success_keyboard = InlineKeyboardMarkup(
             inline_keyboard=[
@@ -879,8 +900,6 @@ async def callback_send_bun_to_all(callback: CallbackQuery):
             await callback.answer()
             return
 
-        success_count = 0
-        error_count = 0
         errors = []
 
         await callback.message.edit_text(
@@ -890,18 +909,22 @@ async def callback_send_bun_to_all(callback: CallbackQuery):
             parse_mode="HTML",
         )
 
-        for chat_id in chat_ids:
+        # Та же рассылка, что и утренняя: разыгрываются только чаты без Булочки Дня
+        # на сегодня, а недоставленные утренние сообщения доставляются повторно
+        broadcast = f"daily_bun:{clock.now():%Y-%m-%d}"
+        await enqueue_daily_bun(broadcast, chat_ids)
+        report = await deliver_broadcast(callback.bot, broadcast)
+        success_count = report.done
+        error_count = report.failed
+        skipped_count = max(0, len(chat_ids) - report.total)
+
+        for chat_id, error in report.errors.items():
             try:
-                await send_random_message(callback.bot, chat_id=chat_id)
-                success_count += 1
-            except Exception as e:
-                error_count += 1
-                try:
-                    chat = await callback.bot.get_chat(chat_id)
-                    chat_name = chat.title if chat.title else f"Чат {chat_id}"
-                except:
-                    chat_name = f"Чат {chat_id}"
-                errors.append(f"• {chat_name}: {str(e)[:50]}...")
+                chat = await callback.bot.get_chat(chat_id)
+                chat_name = chat.title if chat.title else f"Чат {chat_id}"
+            except:
+                chat_name = f"Чат {chat_id}"
+            errors.append(f"• {chat_name}: {error[:50]}...")
 
         result_keyboard = InlineKeyboardMarkup(
             inline_keyboard=[
@@ -921,7 +944,8 @@ async def callback_send_bun_to_all(callback: CallbackQuery):
         result_text = f"✅ <b>Отправка завершена!</b>\n\n"
         result_text += f"📊 <b>Результат:</b>\n"
         result_text += f"• Успешно: {success_count}\n"
-        result_text += f"• Ошибки: {error_count}\n\n"
+        result_text += f"• Ошибки: {error_count}\n"
+        result_text += f"• Пропущено (уже разыграно сегодня): {skipped_count}\n\n"
 
         if errors:
             result_text += f"❌ <b>Ошибки:</b>\n" + "\n".join(errors[:5])
@@ -1102,6 +1126,18 @@ async def handle_send_message(message: types.Message, state_data: dict):
         )
 
 
+def parse_bun_points(text: str) -> tuple[int, int | None]:
+    """Разбор ввода "баллы" или "баллы вес": (баллы, вес редкости или None)."""
+    parts = text.split()
+    if not 1 <= len(parts) <= 2:
+        raise ValueError("Ожидается одно или два числа")
+    points = int(parts[0])
+    weight = int(parts[1]) if len(parts) == 2 else None
+    if points <= 0 or (weight is not None and weight <= 0):
+        raise ValueError("Баллы и вес должны быть больше 0")
+    return points, weight
+
+
 async def handle_add_bun_name(message: types.Message, state_data: dict):
     """Обработка ввода названия новой булочки."""
     bun_name = message.text.strip()
@@ -1143,8 +1179,10 @@ async def handle_add_bun_name(message: types.Message, state_data: dict):
     await message.reply(
         f"➕ <b>Добавление новой булочки</b>\n\n"
         f"Название: <b>{bun_name}</b>\n\n"
-        f"Шаг 2/2: Введите количество баллов для этой булочки.\n\n"
-        f"💡 <i>Число должно быть больше 0</i>",
+        f"Шаг 2/2: Введите количество баллов для этой булочки.\n"
+        f"Через пробел можно указать вес редкости (по умолчанию 1): "
+        f"<code>10 3</code> выпадает втрое чаще булочки с весом 1.\n\n"
+        f"💡 <i>Числа должны быть больше 0</i>",
         parse_mode="HTML",
         reply_markup=keyboard,
     )
@@ -1155,13 +1193,12 @@ async def handle_add_bun_points(message: types.Message, state_data: dict):
     bun_name = state_data["bun_name"]
 
     try:
-        points = int(message.text.strip())
-        if points <= 0:
-            raise ValueError("Баллы должны быть больше 0")
+        points, weight = parse_bun_points(message.text.strip())
+        weight = weight or 1
     except ValueError:
         await message.reply(
             "❌ <b>Некорректное количество баллов</b>\n\n"
-            "Введите целое положительное число (больше 0).\n"
+            "Введите целое положительное число (больше 0) и, если нужно, вес через пробел.\n"
             "Попробуйте еще раз.",
             parse_mode="HTML",
         )
@@ -1172,7 +1209,7 @@ async def handle_add_bun_points(message: types.Message, state_data: dict):
 
     try:
         # Добавляем булочку
-        bun = await add_bun(name=bun_name, points=points)
+        bun = await add_bun(name=bun_name, points=points, weight=weight)
 
         result_keyboard = InlineKeyboardMarkup(
             inline_keyboard=[
@@ -1199,7 +1236,8 @@ async def handle_add_bun_points(message: types.Message, state_data: dict):
             await message.reply(
                 f"✅ <b>Булочка успешно добавлена!</b>\n\n"
                 f"Название: <b>{bun_name}</b>\n"
-                f"Баллы: <b>{points}</b>\n\n"
+                f"Баллы: <b>{points}</b>\n"
+                f"Вес редкости: <b>{weight}</b>\n\n"
                 f"🥐 Теперь игроки могут получить эту булочку в ежедневном розыгрыше!",
                 parse_mode="HTML",
                 reply_markup=result_keyboard,
@@ -1243,13 +1281,11 @@ async def handle_edit_bun_points(message: types.Message, state_data: dict):
     current_points = state_data["current_points"]
 
     try:
-        new_points = int(message.text.strip())
-        if new_points <= 0:
-            raise ValueError("Баллы должны быть больше 0")
+        new_points, new_weight = parse_bun_points(message.text.strip())
     except ValueError:
         await message.reply(
             "❌ <b>Некорректное количество баллов</b>\n\n"
-            "Введите целое положительное число (больше 0).\n"
+            "Введите целое положительное число (больше 0) и, если нужно, вес через пробел.\n"
             "Попробуйте еще раз.",
             parse_mode="HTML",
         )
@@ -1260,7 +1296,7 @@ async def handle_edit_bun_points(message: types.Message, state_data: dict):
 
     try:
         # Редактируем булочку
-        bun = await edit_bun(name=bun_name, points=new_points)
+        bun = await edit_bun(name=bun_name, points=new_points, weight=new_weight)
 
         result_keyboard = InlineKeyboardMarkup(
             inline_keyboard=[
@@ -1288,7 +1324,8 @@ async def handle_edit_bun_points(message: types.Message, state_data: dict):
                 f"✅ <b>Булочка успешно изменена!</b>\n\n"
                 f"Название: <b>{bun_name}</b>\n"
                 f"Было баллов: <b>{current_points}</b>\n"
-                f"Стало баллов: <b>{new_points}</b>\n\n"
+                f"Стало баллов: <b>{new_points}</b>\n"
+                f"Вес редкости: <b>{bun.weight}</b>\n\n"
                 f"🔄 Изменения применены к базе данных!",
                 parse_mode="HTML",
                 reply_markup=result_keyboard,
@@ -1438,8 +1475,9 @@ async def callback_edit_bun_input(callback: CallbackQuery):
         f"✏️ <b>Редактирование булочки</b>\n\n"
         f"Булочка: <b>{bun_name}</b>\n"
         f"Текущие баллы: <b>{current_points}</b>\n\n"
-        f"Введите новое количество баллов для этой булочки.\n\n"
-        f"💡 <i>Число должно быть больше 0</i>",
+        f"Введите новое количество баллов для этой булочки.\n"
+        f"Через пробел можно указать новый вес редкости, иначе он не изменится.\n\n"
+        f"💡 <i>Числа должны быть больше 0</i>",
         parse_mode="HTML",
         reply_markup=keyboard,
     )
@@ -1755,20 +1793,22 @@ async def user_list_handler_internal(message, bot):
 
     for msg in messages:
         await message.reply(msg, parse_mode="HTML")
-        await asyncio.sleep(0.5)
 
 
 async def list_buns_handler_internal(message):
     """Внутренняя функция для списка булочек."""
-    buns = await get_all_buns()
-    if not buns:
+    catalog = await get_bun_catalog()
+    if not catalog:
         await message.reply("Булочек пока нет!")
         return
     text = "<b>Список булочек:</b>\n\n"
-    for name, points in buns.items():
+    for name, points in catalog.points.items():
         from handlers.in_game import pluralize_points
 
-        text += f"- {name}: {pluralize_points(points)}\n"
+        text += (
+            f"- {name}: {pluralize_points(points)}, "
+            f"вес {catalog.weights[name]} ({catalog.chance(name):.1%})\n"
+        )
     await message.reply(text, parse_mode="HTML")
 
 
@@ -1785,9 +1825,9 @@ async def admin_help_handler_internal(message):
         "• 🧹 Массовое удаление всех неактивных игроков (новое!)\n"
         "  → Статистика → Подробный список → Подтверждение → Очистка БД\n\n"
         "<b>🥐 Управление булочками:</b>\n"
-        "• 📋 Просмотр списка всех булочек с баллами\n"
+        "• 📋 Просмотр списка всех булочек с баллами и шансом выпадения\n"
         "• ➕ Добавление новой булочки (пошагово)\n"
-        "  → Название → Баллы → Подтверждение\n"
+        "  → Название → Баллы (и вес редкости) → Подтверждение\n"
         "• ✏️ Редактирование булочки (интерактивно)\n"
         "  → Выбор булочки → Новые баллы → Сохранение\n"
         "• 🗑 Удаление булочки (интерактивно)\n"
@@ -1812,8 +1852,8 @@ async def admin_help_handler_internal(message):
         "⌨️ <b>КЛАССИЧЕСКИЕ КОМАНДЫ (для экспертов):</b>\n"
         "<code>/user_list</code> - Список пользователей\n"
         "<code>/list_buns</code> - Список булочек\n"
-        "<code>/add_bun название баллы</code> - Добавить булочку\n"
-        "<code>/edit_bun название баллы</code> - Изменить булочку\n"
+        "<code>/add_bun название баллы [вес]</code> - Добавить булочку\n"
+        "<code>/edit_bun название баллы [вес]</code> - Изменить булочку\n"
         "<code>/remove_bun название</code> - Удалить булочку\n"
         "<code>/add_points_all chat_id баллы</code> - Очки всем\n"
         "<code>/add_points chat_id @username баллы</code> - Очки пользователю\n"
@@ -1892,18 +1932,8 @@ async def remove_from_game_handler(message: types.Message):
         await message.reply("chat_id и telegram_id должны быть целыми числами!")
         return
 
-    # Получаем список всех пользователей для проверки существования
-    users = await get_all_users()
-    if not users:
-        await message.reply("Список пользователей пуст.")
-        return
-
     # Ищем пользователя с указанными chat_id и telegram_id
-    target_user = None
-    for user in users:
-        if user["chat_id"] == chat_id and user["telegram_id"] == telegram_id:
-            target_user = user
-            break
+    target_user = await get_chat_member(chat_id, telegram_id)
 
     if not target_user:
         await message.reply(
@@ -1947,20 +1977,25 @@ async def add_bun_handler(message: types.Message):
         )
         return
 
-    args = message.text.split(maxsplit=2)[1:]  # Пропускаем команду
-    if len(args) != 2:
-        await message.reply("Использование: /add_bun <название> <баллы>")
+    args = message.text.split(maxsplit=3)[1:]  # Пропускаем команду
+    if len(args) not in (2, 3):
+        await message.reply("Использование: /add_bun <название> <баллы> [вес_редкости]")
         return
 
-    name, points_str = args
+    name, points_str = args[:2]
     try:
         points = int(points_str)
         if points < 0:
             raise ValueError("Баллы не могут быть отрицательными!")
+        weight = int(args[2]) if len(args) == 3 else 1
+        if weight <= 0:
+            raise ValueError("Вес редкости должен быть больше 0!")
 
-        bun = await add_bun(name=name, points=points)
+        bun = await add_bun(name=name, points=points, weight=weight)
         if bun:
-            await message.reply(f"Булочка '{name}' с {points} баллами добавлена!")
+            await message.reply(
+                f"Булочка '{name}' с {points} баллами (вес {weight}) добавлена!"
+            )
         else:
             await message.reply(f"Булочка '{name}' уже существует!")
     except ValueError as e:
@@ -1976,20 +2011,27 @@ async def edit_bun_handler(message: types.Message):
         )
         return
 
-    args = message.text.split(maxsplit=2)[1:]  # Пропускаем команду
-    if len(args) != 2:
-        await message.reply("Использование: /edit_bun <название> <новые_баллы>")
+    args = message.text.split(maxsplit=3)[1:]  # Пропускаем команду
+    if len(args) not in (2, 3):
+        await message.reply(
+            "Использование: /edit_bun <название> <новые_баллы> [вес_редкости]"
+        )
         return
 
-    name, points_str = args
+    name, points_str = args[:2]
     try:
         points = int(points_str)
         if points < 0:
             raise ValueError("Баллы не могут быть отрицательными!")
+        weight = int(args[2]) if len(args) == 3 else None
+        if weight is not None and weight <= 0:
+            raise ValueError("Вес редкости должен быть больше 0!")
 
-        bun = await edit_bun(name=name, points=points)
+        bun = await edit_bun(name=name, points=points, weight=weight)
         if bun:
-            await message.reply(f"Булочка '{name}' обновлена: теперь {points} баллов.")
+            await message.reply(
+                f"Булочка '{name}' обновлена: теперь {points} баллов, вес {bun.weight}."
+            )
         else:
             await message.reply(f"Булочка '{name}' не найдена!")
     except ValueError as e:
@@ -2052,8 +2094,12 @@ async def send_to_chat_handler(message: types.Message, bot):
 
     await message.reply(f"Отправляю сообщение в чат {chat_id}...")
     try:
-        await send_random_message(bot, chat_id)
-        await message.reply(f"Сообщение успешно отправлено в чат {chat_id}!")
+        if await send_random_message(bot, chat_id):
+            await message.reply(f"Сообщение успешно отправлено в чат {chat_id}!")
+        else:
+            await message.reply(
+                f"В чате {chat_id} Булочка Дня сегодня уже разыграна, повторный розыгрыш пропущен."
+            )
     except Exception as e:
         await message.reply(f"Ошибка при отправке в чат {chat_id}: {str(e)}")
 
@@ -2075,10 +2121,9 @@ async def handle_points_all_chat_id(message: types.Message, state_data: dict):
         return
 
     # Проверяем существование чата и пользователей
-    users = await get_all_users()
-    chat_users = [u for u in users if u["chat_id"] == chat_id and u["in_game"]]
+    active_count = await count_chat_members(chat_id)
 
-    if not chat_users:
+    if not active_count:
         await message.reply(
             f"❌ <b>Чат не найден или нет активных игроков</b>\n\n"
             f"В чате с ID <code>{chat_id}</code> нет активных пользователей игры.\n"
@@ -2099,7 +2144,7 @@ async def handle_points_all_chat_id(message: types.Message, state_data: dict):
         "state": POINTS_STATES["waiting_for_points_all"],
         "chat_id": chat_id,
         "chat_title": chat_title,
-        "user_count": len(chat_users),
+        "user_count": active_count,
     }
 
     keyboard = InlineKeyboardMarkup(
@@ -2112,7 +2157,7 @@ async def handle_points_all_chat_id(message: types.Message, state_data: dict):
         f"➕ <b>Добавление очков всем пользователям</b>\n\n"
         f"Чат: <b>{chat_title}</b>\n"
         f"ID: <code>{chat_id}</code>\n"
-        f"Активных игроков: <b>{len(chat_users)}</b>\n\n"
+        f"Активных игроков: <b>{active_count}</b>\n\n"
         f"Шаг 2/2: Введите количество очков для добавления всем пользователям.\n\n"
         f"💡 <i>Можно использовать диапазон: 5-10 (каждый получит случайное число из диапазона)</i>\n"
         f"💡 <i>Отрицательные числа отнимают очки</i>",
@@ -2152,13 +2197,10 @@ async def handle_points_all_amount(message: types.Message, state_data: dict):
     del user_states[message.from_user.id]
 
     try:
-        # Импортируем функцию из admin_points
-        from handlers.admin_points import apply_points_to_user
         import random
 
-        # Получаем пользователей чата
-        users = await get_all_users()
-        chat_users = [u for u in users if u["chat_id"] == chat_id and u["in_game"]]
+        # Получаем активных игроков чата
+        chat_users = await get_chat_members(chat_id)
 
         updated_count = 0
         for user_data in chat_users:
@@ -2167,7 +2209,7 @@ async def handle_points_all_amount(message: types.Message, state_data: dict):
                 if min_points != max_points
                 else min_points
             )
-            new_points, is_new_croissant = await apply_points_to_user(
+            new_points, is_new_croissant = await apply_points_delta(
                 user_data["telegram_id"], chat_id, points
             )
             if is_new_croissant:
@@ -2259,10 +2301,7 @@ async def handle_points_user_chat_id(message: types.Message, state_data: dict):
         return
 
     # Проверяем существование чата и пользователей
-    users = await get_all_users()
-    chat_users = [u for u in users if u["chat_id"] == chat_id and u["in_game"]]
-
-    if not chat_users:
+    if not await count_chat_members(chat_id):
         await message.reply(
             f"❌ <b>Чат не найден или нет активных игроков</b>\n\n"
             f"В чате с ID <code>{chat_id}</code> нет активных пользователей игры.\n"
@@ -2395,12 +2434,8 @@ async def handle_points_user_amount(message: types.Message, state_data: dict):
     del user_states[message.from_user.id]
 
     try:
-        # Импортируем функцию из admin_points
-        from handlers.admin_points import apply_points_to_user
-        import random
-
         # Применяем очки
-        new_points, is_new_croissant = await apply_points_to_user(
+        new_points, is_new_croissant = await apply_points_delta(
             user.telegram_id, chat_id, points
         )
 
@@ -2489,10 +2524,7 @@ async def handle_set_points_chat_id(message: types.Message, state_data: dict):
         return
 
     # Проверяем существование чата и пользователей
-    users = await get_all_users()
-    chat_users = [u for u in users if u["chat_id"] == chat_id and u["in_game"]]
-
-    if not chat_users:
+    if not await count_chat_members(chat_id):
         await message.reply(
             f"❌ <b>Чат не найден или нет активных игроков</b>\n\n"
             f"В чате с ID <code>{chat_id}</code> нет активных пользователей игры.\n"
@@ -2551,7 +2583,7 @@ async def handle_set_points_username(message: types.Message, state_data: dict):
     username = username_text[1:]  # Убираем @
 
     # Проверяем существование пользователя
-    from database.queries import get_user_by_username, get_user_buns_stats
+    from database.queries import get_user_by_username, get_user_score
 
     user = await get_user_by_username(chat_id, username)
 
@@ -2565,8 +2597,8 @@ async def handle_set_points_username(message: types.Message, state_data: dict):
         return
 
     # Получаем текущие очки
-    buns = await get_user_buns_stats(user.telegram_id, chat_id)
-    current_points = sum(bun["points"] for bun in buns) if buns else 0
+    score = await get_user_score(user.telegram_id, chat_id)
+    current_points = score["total_points"] if score else 0
 
     # Обновляем состояние
     user_states[message.from_user.id] = {
@@ -2626,11 +2658,9 @@ async def handle_set_points_amount(message: types.Message, state_data: dict):
     del user_states[message.from_user.id]
 
     try:
-        # Применяем изменение очков
-        from handlers.admin_points import apply_points_to_user
-
-        new_points, is_new_croissant = await apply_points_to_user(
-            user.telegram_id, chat_id, points_diff
+        # Устанавливаем итог одной транзакцией
+        new_points, is_new_croissant = await set_points_total(
+            user.telegram_id, chat_id, new_total
         )
 
         if is_new_croissant:
@@ -2746,8 +2776,10 @@ async def callback_send_evening_humor(callback: CallbackQuery):
             )
             return
 
-        # Используем функцию из evening_humor модуля
-        await send_evening_humor(callback.bot)
+        # Используем функцию из evening_humor модуля (отдельная рассылка для ручного теста)
+        await send_evening_humor(
+            callback.bot, broadcast=f"evening_humor:manual:{clock.now():%Y-%m-%d_%H%M%S}"
+        )
 
         result_keyboard = InlineKeyboardMarkup(
             inline_keyboard=[
@@ -2900,6 +2932,83 @@ async def callback_evening_schedule_status(callback: CallbackQuery):
     await callback.answer()
 
 
+@admin_cntr.callback_query(F.data == "cmd_db_settings")
+async def callback_db_settings(callback: CallbackQuery):
+    """Показать активные настройки SQLite."""
+    if callback.from_user.id != ADMIN:
+        await callback.answer("❌ Доступ запрещен", show_alert=True)
+        return
+
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="🔄 Обновить", callback_data="cmd_db_settings"
+                )
+            ],
+            [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_other")],
+        ]
+    )
+
+    try:
+        settings = await get_sqlite_settings()
+        synchronous = {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}
+        temp_store = {0: "DEFAULT", 1: "FILE", 2: "MEMORY"}
+        cache_size = settings["cache_size"]
+        cache_text = (
+            f"{-cache_size // 1024} МБ" if cache_size < 0 else f"{cache_size} страниц"
+        )
+
+        status_text = "🗄 <b>Настройки базы данных (SQLite)</b>\n\n"
+        status_text += f"📒 <b>journal_mode:</b> {settings['journal_mode']}\n"
+        status_text += f"💾 <b>synchronous:</b> {synchronous.get(settings['synchronous'], settings['synchronous'])}\n"
+        status_text += f"🗺 <b>mmap_size:</b> {settings['mmap_size'] // (1024 * 1024)} МБ\n"
+        status_text += f"📦 <b>cache_size:</b> {cache_text}\n"
+        status_text += f"🧠 <b>temp_store:</b> {temp_store.get(settings['temp_store'], settings['temp_store'])}\n"
+        status_text += f"⏳ <b>busy_timeout:</b> {settings['busy_timeout']} мс\n\n"
+        status_text += f"📁 <b>Размер базы:</b> {settings['file_size'] / 1024:.0f} КБ\n"
+        status_text += f"📝 <b>Размер WAL:</b> {settings['file_size-wal'] / 1024:.0f} КБ\n"
+        status_text += f"🧹 <b>WAL checkpoint:</b> каждые {SQLITE_CHECKPOINT_INTERVAL} с\n\n"
+
+        cache = leaderboard_cache.stats()
+        status_text += (
+            f"🏆 <b>Кэш топа /stats:</b> {cache['size']}/{cache['maxsize']} чатов, "
+            f"попаданий {cache['hits']}, промахов {cache['misses']} "
+            f"({cache['hit_rate']:.0%})\n"
+        )
+        cache = membership_cache.stats()
+        status_text += (
+            f"👥 <b>Кэш участия в игре:</b> {cache['size']}/{cache['maxsize']} записей, "
+            f"попаданий {cache['hits']}, промахов {cache['misses']} "
+            f"({cache['hit_rate']:.0%})\n\n"
+        )
+        status_text += f"🔁 <b>Повторы операций:</b> {retry_stats.summary()}"
+        # Операции, которые чаще всего приходилось повторять
+        noisy = sorted(
+            set(retry_stats.retries) | set(retry_stats.failures),
+            key=lambda name: (retry_stats.failures[name], retry_stats.retries[name]),
+            reverse=True,
+        )[:5]
+        for name in noisy:
+            status_text += (
+                f"\n  • <code>{name}</code>: повторов {retry_stats.retries[name]}, "
+                f"неудач {retry_stats.failures[name]}"
+            )
+
+        await callback.message.edit_text(
+            status_text, parse_mode="HTML", reply_markup=keyboard
+        )
+    except Exception as e:
+        await callback.message.edit_text(
+            f"❌ <b>Ошибка при получении настроек базы</b>\n\n"
+            f"Детали: <code>{str(e)}</code>",
+            parse_mode="HTML",
+            reply_markup=keyboard,
+        )
+
+    await callback.answer()
+
+
 @admin_cntr.callback_query(F.data == "cmd_restart_evening_scheduler")
 async def callback_restart_evening_scheduler(callback: CallbackQuery):
     """Перезапуск планировщика вечерних сообщений."""
@@ -3014,8 +3123,8 @@ async def callback_cleanup_inactive_users(callback: CallbackQuery):
             )
             return
 
-        # Получаем детальную информацию по чатам
-        inactive_by_chat = await get_inactive_users_by_chat()
+        # Получаем количество по чатам
+        inactive_by_chat = await get_inactive_users_summary()
 
         # Формируем подробный отчет
         report_text = f"🧹 <b>Массовое удаление неактивных пользователей</b>\n\n"
@@ -3026,8 +3135,7 @@ async def callback_cleanup_inactive_users(callback: CallbackQuery):
         chat_count = len(inactive_by_chat)
         if chat_count > 0:
             report_text += f"📈 <b>Распределение по чатам:</b>\n"
-            for chat_id, users in inactive_by_chat.items():
-                user_count = len(users)
+            for chat_id, user_count in inactive_by_chat.items():
                 report_text += f"• Чат {chat_id}: {user_count} пользователей\n"
             report_text += "\n"
 
@@ -3216,13 +3324,13 @@ async def callback_confirm_bulk_cleanup(callback: CallbackQuery):
 
         if deleted_by_chat:
             report_text += f"📊 <b>Статистика по чатам:</b>\n"
-            for chat_id, users in deleted_by_chat.items():
-                report_text += f"📍 <b>Чат {chat_id}:</b> {len(users)} пользователей\n"
+            for chat_id, chat in deleted_by_chat.items():
+                report_text += f"📍 <b>Чат {chat_id}:</b> {chat['count']} пользователей\n"
                 # Показываем первых нескольких пользователей
-                for i, user in enumerate(users[:3]):
-                    report_text += f"  • {user['display_name']}\n"
-                if len(users) > 3:
-                    report_text += f"  • ... и еще {len(users) - 3}\n"
+                for display_name in chat["sample"]:
+                    report_text += f"  • {display_name}\n"
+                if chat["count"] > len(chat["sample"]):
+                    report_text += f"  • ... и еще {chat['count'] - len(chat['sample'])}\n"
                 report_text += "\n"
 
         report_text += "🧹 <b>Очищены данные:</b>\n"
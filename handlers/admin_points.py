@@ -2,13 +2,10 @@ from aiogram import Bot, Router
 from aiogram.types import Message
 from aiogram.filters import Command
 from database.queries import (
-    get_user_by_id,
     get_user_by_username,
-    update_user_points,
-    get_all_users,
-    get_user_buns_stats,
-    add_or_update_user_bun,
+    get_chat_members,
 )
+from services.game import apply_points_delta
 from logger import logger
 from config import ADMIN
 import random
@@ -65,51 +62,6 @@ NO_ACTIVE_USERS_MESSAGE = "В пекарне пусто — нет активн
 NOT_PRIVATE_MESSAGE = "Эти команды работают только в личке главного пекаря!"
 
 
-async def apply_points_to_user(
-    telegram_id: int, chat_id: int, points: int
-) -> tuple[int, bool]:
-    """Применяет очки к пользователю, возвращает новые очки и флаг нового Круассана."""
-    # Получаем user_id из таблицы users
-    user = await get_user_by_id(telegram_id, chat_id)
-    if not user:
-        logger.warning(
-            f"Пользователь telegram_id={telegram_id} не найден в чате {chat_id}"
-        )
-        return 0, False
-
-    user_id = user.id  # Получаем user_id из объекта пользователя
-    buns = await get_user_buns_stats(telegram_id, chat_id)
-
-    if not buns:  # Если булочек нет, добавляем Круассан с базовыми очками
-        user_bun = await add_or_update_user_bun(user_id, "Круассан", chat_id)
-        if not user_bun:
-            logger.error(
-                f"Не удалось добавить Круассан для user_id={user_id} в чате {chat_id}"
-            )
-            return 0, False
-
-        base_points = user_bun.points  # Базовые очки Круассана (2 из таблицы buns)
-        new_total = max(0, points)  # Итоговые очки равны запрошенным
-        if new_total != base_points:
-            # Корректируем до запрошенных очков
-            additional_points = new_total - base_points
-            total_points = base_points + additional_points
-            await update_user_points(
-                telegram_id, chat_id, total_points - base_points
-            )  # Добавляем только разницу
-        logger.info(
-            f"Добавлен Круассан с базовыми {base_points} очками, итого: {new_total}"
-        )
-        return new_total, True  # True — это новый Круассан
-    else:  # Если булочки есть, добавляем только новые очки
-        total_points = sum(bun["points"] for bun in buns)
-        await update_user_points(
-            telegram_id, chat_id, points
-        )  # Передаём только новые очки
-        new_total = max(0, total_points + points)
-        return new_total, False  # False — Круассан не добавлен
-
-
 @admin_points_r.message(Command("add_points_all"))
 async def add_points_all_handler(message: Message, bot: Bot):
     """Обработчик команды /add_points_all <chat_id> <points> или <min-max>: изменяет очки всем участникам в указанном чате."""
@@ -150,10 +102,7 @@ async def add_points_all_handler(message: Message, bot: Bot):
         return
 
     # Получаем всех активных участников чата
-    all_users = await get_all_users()
-    chat_users = [
-        user for user in all_users if user["chat_id"] == chat_id and user["in_game"]
-    ]
+    chat_users = await get_chat_members(chat_id)
 
     if not chat_users:
         await message.reply(NO_ACTIVE_USERS_MESSAGE)
@@ -169,7 +118,7 @@ async def add_points_all_handler(message: Message, bot: Bot):
             if min_points != max_points
             else min_points
         )
-        new_points, is_new_croissant = await apply_points_to_user(
+        new_points, is_new_croissant = await apply_points_delta(
             user_data["telegram_id"], chat_id, points
         )
         if is_new_croissant:
@@ -263,7 +212,7 @@ async def add_points_handler(message: Message, bot: Bot):
         return
 
     # Применяем очки
-    new_points, is_new_croissant = await apply_points_to_user(
+    new_points, is_new_croissant = await apply_points_delta(
         target_data.telegram_id, chat_id, points
     )
     if is_new_croissant:
@@ -1,12 +1,11 @@
-import asyncio
 import random
-from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 from aiogram import Bot
-from database.queries import get_active_chat_ids
+from database.queries import get_active_chat_ids, enqueue_broadcast
+from handlers.outbox import OUTBOX_KIND_TEXT, deliver_broadcast
 from logger import logger
-from config import REQUEST_DELAY
+from utils import clock
 
 # Список юморных вечерних фраз
 EVENING_HUMOR_PHRASES = [
@@ -23,41 +22,32 @@ EVENING_HUMOR_PHRASES = [
 ]
 
 
-async def send_evening_humor(bot: Bot):
-    """Отправка вечернего юморного сообщения во все активные чаты."""
+async def send_evening_humor(bot: Bot, broadcast: Optional[str] = None):
+    """Отправка вечернего юморного сообщения во все активные чаты через outbox."""
     try:
         chat_ids = await get_active_chat_ids()
         if not chat_ids:
             logger.warning("Нет активных чатов для отправки вечерних сообщений.")
-            return
+            return None
 
         # Выбираем случайную фразу
         humor_message = random.choice(EVENING_HUMOR_PHRASES)
 
-        sent_count = 0
-        error_count = 0
-
-        for chat_id in chat_ids:
-            try:
-                await bot.send_message(chat_id=chat_id, text=humor_message)
-                sent_count += 1
-                logger.info(f"Вечернее юморное сообщение отправлено в чат {chat_id}")
-
-                # Задержка между отправками для избежания flood control
-                await asyncio.sleep(REQUEST_DELAY)
-
-            except Exception as e:
-                error_count += 1
-                logger.error(
-                    f"Ошибка при отправке вечернего сообщения в чат {chat_id}: {e}"
-                )
+        # Ключ рассылки: повторный запуск за тот же день добирает только недоставленные чаты
+        broadcast = broadcast or f"evening_humor:{clock.now():%Y-%m-%d}"
+        await enqueue_broadcast(
+            broadcast, chat_ids, OUTBOX_KIND_TEXT, payload=humor_message
+        )
+        report = await deliver_broadcast(bot, broadcast)
 
         logger.info(
-            f"Вечерние сообщения отправлены: успешно {sent_count}, ошибок {error_count}"
+            f"Вечерние сообщения отправлены: успешно {report.done}, ошибок {report.failed}"
         )
+        return report
 
     except Exception as e:
         logger.error(f"Ошибка при отправке вечерних юморных сообщений: {e}")
+        raise
 
 
 def get_random_evening_phrase() -> str:
@@ -70,7 +60,7 @@ def get_moscow_hour() -> int:
     from datetime import timezone, timedelta
 
     moscow_tz = timezone(timedelta(hours=3))
-    moscow_time = datetime.now(moscow_tz)
+    moscow_time = clock.now(moscow_tz)
     return moscow_time.hour
 
 
@@ -96,7 +86,7 @@ def get_evening_schedule_info() -> dict:
     from datetime import timezone, timedelta
 
     moscow_tz = timezone(timedelta(hours=3))
-    moscow_time = datetime.now(moscow_tz)
+    moscow_time = clock.now(moscow_tz)
 
     return {
         "current_moscow_time": moscow_time.strftime("%H:%M:%S"),
@@ -8,6 +8,7 @@ from database.queries import (
     add_user,
     get_user_buns_stats,
     get_top_users_by_points,
+    get_user_score,
     set_user_out_of_game,
 )
 from handlers.start import check_bot_admin
@@ -108,7 +109,6 @@ async def stats_me_handler(message: types.Message):
         return
     username = message.from_user.username or message.from_user.full_name
     stats_text = f"<b>🧁 Статистика @{username}:</b>\n\n"
-    total_points = 0
     for i, item in enumerate(user_buns, start=1):
         bun = item["bun"]
         count = item["count"]
@@ -116,9 +116,10 @@ async def stats_me_handler(message: types.Message):
         times_text = pluralize_times(count)
         points_text = pluralize_points(points)
         stats_text += f"{i}. {bun} - {times_text} ({points_text}) 🔥\n"
-        total_points += points
-    total_points_text = pluralize_points(total_points)
-    stats_text += f"\n<b>Всего:</b> {total_points_text}"
+    score = await get_user_score(telegram_id=user_id, chat_id=chat_id)
+    if score:
+        total_points_text = pluralize_points(score["total_points"])
+        stats_text += f"\n<b>Всего:</b> {total_points_text}, место в чате: {score['rank']} 🏅"
     await message.reply(stats_text, parse_mode="HTML")
 
 
@@ -137,8 +138,11 @@ async def statistic_handler(message: types.Message):
     stats_text = "<b>🏆 Топ-10 игроков по очкам:</b>\n\n"
     for i, user in enumerate(top_users, start=1):
         display_name = f"@{user['username']}" if user["username"] else user["full_name"]
+        points_text = pluralize_points(user["points"])
         times_text = pluralize_times(user["count"])
-        stats_text += f"{i}. {display_name} - {user['bun']} ({times_text})\n"
+        stats_text += (
+            f"{i}. {display_name} - {points_text}, лучшая: {user['bun']} ({times_text})\n"
+        )
     await message.reply(stats_text, parse_mode="HTML")
 
 
@@ -0,0 +1,144 @@
+# handlers/outbox.py
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from config import (
+    DRAW_CONCURRENCY,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_BASE,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_TTL_HOURS,
+    OUTBOX_SENDING_TIMEOUT,
+)
+from database.queries import (
+    claim_outbox_message,
+    get_broadcast_chat_ids,
+    get_due_outbox,
+    mark_outbox_delivered,
+    mark_outbox_failed,
+    expire_outbox,
+    requeue_stale_outbox,
+)
+from handlers.random_user import draw_daily_buns, play_daily_bun, send_random_message
+from logger import logger
+from utils import clock
+from utils.broadcast import BroadcastReport, run_broadcast
+from utils.circuit_breaker import circuit_breaker
+from utils.lease import scheduler_lease
+
+# Типы сообщений в outbox
+OUTBOX_KIND_TEXT = "text"  # Обычный текст из payload
+OUTBOX_KIND_DAILY_BUN = "daily_bun"  # Анимация заранее разыгранной Булочки Дня
+
+
+async def _send_outbox_message(bot: Bot, row: dict):
+    """Фактическая отправка одного сообщения outbox."""
+    if row["kind"] == OUTBOX_KIND_TEXT:
+        await bot.send_message(chat_id=row["chat_id"], text=row["payload"])
+    elif row["kind"] == OUTBOX_KIND_DAILY_BUN:
+        if row["payload"]:
+            await play_daily_bun(bot, row["chat_id"], row["payload"])
+        else:
+            # Строка поставлена до двухфазного розыгрыша - разыгрываем на месте
+            await send_random_message(bot, chat_id=row["chat_id"])
+    else:
+        raise ValueError(f"Неизвестный тип сообщения outbox: {row['kind']}")
+
+
+async def enqueue_daily_bun(broadcast: str, chat_ids: list[int]) -> int:
+    """Розыгрыш Булочки Дня для чатов, еще не попавших в рассылку, и постановка в outbox.
+
+    Чаты, где сегодня уже разыграли, пропускаются без повторного начисления.
+    Победители и строки outbox записываются одной транзакцией до отправки:
+    булочка не может быть начислена без объявления, а сбой доставки не влияет
+    на результат - повтор проигрывает тот же сценарий.
+    """
+    queued = await get_broadcast_chat_ids(broadcast)
+    chat_ids = [chat_id for chat_id in chat_ids if chat_id not in queued]
+    if not chat_ids:
+        return 0
+    # В рассылку попадают только чаты, разыгранные сейчас
+    scripts = await draw_daily_buns(chat_ids, broadcast, OUTBOX_KIND_DAILY_BUN)
+    return len(scripts)
+
+
+def _next_retry_at(attempts: int, error: Exception) -> datetime | None:
+    """Время следующей попытки или None, если повторять бессмысленно."""
+    # Бот удален из чата, чат не существует и т.п. - повтор не поможет
+    if isinstance(error, (TelegramForbiddenError, TelegramBadRequest)):
+        return None
+    if attempts >= OUTBOX_MAX_ATTEMPTS:
+        return None
+    return clock.now() + timedelta(seconds=OUTBOX_RETRY_BASE * 2 ** (attempts - 1))
+
+
+async def _deliver_rows(bot: Bot, broadcast: str, rows: list[dict]) -> BroadcastReport:
+    """Доставка строк одной рассылки (chat_id внутри рассылки уникален).
+
+    Строки могут быть из устаревшего снимка, поэтому каждая перед отправкой
+    захватывается в базе: строку, уже захваченную другим доставщиком, пропускаем.
+    """
+    rows_by_chat = {row["chat_id"]: row for row in rows}
+
+    async def deliver(chat_id: int):
+        row = rows_by_chat[chat_id]
+        if not await claim_outbox_message(row["id"], OUTBOX_SENDING_TIMEOUT):
+            logger.debug(f"Outbox {broadcast}: чат {chat_id} уже доставляется или доставлен")
+            return
+        try:
+            await _send_outbox_message(bot, row)
+        except Exception as e:
+            attempts = row["attempts"] + 1
+            retry_at = _next_retry_at(attempts, e)
+            await mark_outbox_failed(row["id"], str(e), retry_at)
+            if retry_at:
+                logger.warning(
+                    f"Outbox {broadcast}: чат {chat_id}, попытка {attempts} неудачна, "
+                    f"повтор в {retry_at:%H:%M:%S}"
+                )
+            raise
+        await mark_outbox_delivered(row["id"])
+
+    return await run_broadcast(
+        broadcast, list(rows_by_chat), deliver, concurrency=DRAW_CONCURRENCY
+    )
+
+
+async def deliver_broadcast(bot: Bot, broadcast: str) -> BroadcastReport:
+    """Доставка всех ожидающих сообщений одной рассылки."""
+    rows = await get_due_outbox(broadcast=broadcast)
+    return await _deliver_rows(bot, broadcast, rows)
+
+
+async def deliver_outbox(bot: Bot) -> list[BroadcastReport]:
+    """Доставка всех созревших сообщений outbox, сгруппированных по рассылкам."""
+    await requeue_stale_outbox()
+    await expire_outbox(clock.now() - timedelta(hours=OUTBOX_TTL_HOURS))
+    rows_by_broadcast = defaultdict(list)
+    for row in await get_due_outbox():
+        rows_by_broadcast[row["broadcast"]].append(row)
+
+    reports = []
+    for broadcast, rows in rows_by_broadcast.items():
+        reports.append(await _deliver_rows(bot, broadcast, rows))
+    return reports
+
+
+async def run_outbox_worker(bot: Bot):
+    """Фоновый воркер: повторы с backoff и рассылки, прерванные перезапуском."""
+    logger.info("Воркер outbox запущен")
+    while True:
+        # Пока Telegram API недоступен, не расходуем попытки доставки;
+        # фоновую доставку ведет только владелец аренды
+        if circuit_breaker.is_open or not scheduler_lease.is_held:
+            await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+            continue
+        try:
+            await deliver_outbox(bot)
+        except Exception as e:
+            logger.error(f"Ошибка воркера outbox: {e}")
+        await asyncio.sleep(OUTBOX_POLL_INTERVAL)
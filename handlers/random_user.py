@@ -1,8 +1,10 @@
 # handlers/random_user.py
 import asyncio
+import functools
+import json
 import random
 from aiogram import Bot
-from database.queries import get_fair_random_user, add_or_update_user_bun, get_all_buns, save_daily_selection
+from database.queries import draw_daily_winners
 from logger import logger
 
 
@@ -33,38 +35,66 @@ SHURSHU_MESSAGES = [
 ]
 
 
-async def send_random_message(bot: Bot, chat_id: int):
-    """Отправка интерактивного сообщения с выбором справедливо случайной булочки."""
-    user = await get_fair_random_user(chat_id=chat_id)
-    if not user:
-        await bot.send_message(
-            chat_id,
-            "В этом чате нет активных игроков с username! 😔\n"
-            "Попросите участников установить username в настройках Telegram."
-        )
-        logger.warning(f"Нет активных пользователей с username в чате {chat_id}")
-        return
+async def draw_daily_buns(
+    chat_ids: list[int], broadcast: str | None = None, kind: str | None = None
+) -> dict[int, str]:
+    """Фаза 1: розыгрыш во всех чатах одной транзакцией.
+
+    Возвращает готовый сценарий анимации для каждого разыгранного чата (JSON
+    для outbox), чтобы при отправке не было обращений к базе. Чаты, где
+    сегодня уже есть Булочка Дня, в результат не попадают. С broadcast
+    сценарии ставятся в outbox (тип kind) в транзакции самого розыгрыша.
+    """
+    build = functools.partial(build_daily_bun_scripts, chat_ids)
+    if broadcast is None:
+        return build(await draw_daily_winners(chat_ids))
+    draw = await draw_daily_winners(chat_ids, announce=(broadcast, kind, build))
+    return draw["payloads"]
+
+
+def build_daily_bun_scripts(chat_ids: list[int], draw: dict) -> dict[int, str]:
+    """Сценарии анимации (JSON) для разыгранных чатов по результату draw_daily_winners."""
+    bun_names = list(draw["buns"])
+    skipped = set(draw["skipped"])
+    scripts = {}
+    for chat_id in chat_ids:
+        if chat_id in skipped:
+            continue
+        winner = draw["winners"].get(chat_id)
+        if not bun_names:
+            script = {"text": "Булочки ещё не добавлены в базу! 😱"}
+        elif not winner:
+            script = {
+                "text": "В этом чате нет активных игроков с username! 😔\n"
+                "Попросите участников установить username в настройках Telegram."
+            }
+        else:
+            display_name = winner["display_name"]
+            script = {
+                "pre": random.choice(SHURSHU_MESSAGES).format(user=display_name),
+                "animation": random.sample(bun_names, min(5, len(bun_names))),
+                "final": random.choice(MESSAGES).format(
+                    user=display_name, bun=winner["bun"]
+                ),
+            }
+        scripts[chat_id] = json.dumps(script, ensure_ascii=False)
+    return scripts
 
-    display_name = f"@{user.username}" if user.username else user.full_name
 
-    buns_points = await get_all_buns()
-    if not buns_points:
-        await bot.send_message(chat_id, "Булочки ещё не добавлены в базу! 😱")
-        logger.error(f"Таблица buns пуста для чата {chat_id}")
+async def play_daily_bun(bot: Bot, chat_id: int, script: str):
+    """Фаза 2: проигрывание заранее разыгранной Булочки Дня (только запросы к Telegram)."""
+    script = json.loads(script)
+    if "text" in script:
+        await bot.send_message(chat_id, script["text"])
         return
 
-    pre_message = random.choice(SHURSHU_MESSAGES)
-    await bot.send_message(
-        chat_id, pre_message.format(user=display_name), parse_mode="HTML"
-    )
+    await bot.send_message(chat_id, script["pre"], parse_mode="HTML")
     await asyncio.sleep(1)
 
-    bun_names = list(buns_points.keys())
     text = "Крутим барабан булочек... 🎡"
     msg = await bot.send_message(chat_id, text, parse_mode="HTML")
 
-    animation_buns = random.sample(bun_names, min(5, len(bun_names)))
-    for random_bun in animation_buns:
+    for random_bun in script["animation"]:
         await msg.edit_text(f"Крутим барабан булочек... 🎡\nТекущая: {random_bun}")
         await asyncio.sleep(0.8)
 
@@ -73,25 +103,20 @@ async def send_random_message(bot: Bot, chat_id: int):
         await msg.edit_text(effect)
         await asyncio.sleep(1)
 
-    bun, points_per_bun = random.choice(list(buns_points.items()))
-    final_message = random.choice(MESSAGES).format(user=display_name, bun=bun)
     await msg.edit_text(
-        final_message,
+        script["final"],
         parse_mode="HTML",
     )
 
-    try:
-        # Сохраняем булочку пользователю
-        await add_or_update_user_bun(user_id=user.id, bun=bun, chat_id=chat_id)
-        
-        # Сохраняем информацию о ежедневном выборе для справедливого алгоритма
-        await save_daily_selection(chat_id=chat_id, user_id=user.id, bun_name=bun)
-        
-        logger.info(f"Булочка {bun} добавлена для {display_name} в чате {chat_id}")
-    except Exception as e:
-        logger.error(
-            f"Ошибка при сохранении булочки для {user.id} в чате {chat_id}: {e}"
-        )
-        await bot.send_message(
-            chat_id, "Ой! Не удалось сохранить булочку, попробуй позже! 😓"
-        )
+
+async def send_random_message(bot: Bot, chat_id: int) -> bool:
+    """Розыгрыш и анимация Булочки Дня в одном чате.
+
+    Возвращает False, если сегодня в чате уже разыграли.
+    """
+    scripts = await draw_daily_buns([chat_id])
+    if chat_id not in scripts:
+        logger.info(f"Булочка Дня в чате {chat_id} сегодня уже разыграна")
+        return False
+    await play_daily_bun(bot, chat_id, scripts[chat_id])
+    return True
@@ -1,25 +1,40 @@
 import asyncio
 import signal
 import sys
+from typing import Optional
 
 # Импортируем логгер в самом начале - он сам настроит все нужное
 from logger import logger
 
-import aiocron
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand, ErrorEvent
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramServerError, TelegramNetworkError
 
-from config import API_TOKEN, REQUEST_DELAY
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import (
+    API_TOKEN,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+)
 from handlers.admin_cntr import admin_cntr
 from handlers.admin_points import admin_points_r
 
 from handlers.exceptions import error_router
 from handlers.in_game import in_game_r
 from handlers.new_member import new_member_r
-from handlers.random_user import send_random_message
+from handlers.outbox import (
+    deliver_broadcast,
+    enqueue_daily_bun,
+    run_outbox_worker,
+)
 from handlers.evening_humor import (
     send_evening_humor,
     get_random_evening_cron,
@@ -27,12 +42,28 @@ from handlers.evening_humor import (
 from handlers.start import start_r
 
 from database.queries import get_active_chat_ids
-from database.db import create_missing_tables
+from database.db import run_wal_checkpoint_worker
+from database.migrations import run_migrations
+from utils.rate_limiter import setup_rate_limiter
+from utils.retry import setup_retry
+from utils import clock
+from utils.circuit_breaker import CircuitOpenError, setup_circuit_breaker
+from utils.scheduler import scheduler
+from utils.lease import scheduler_lease
+from utils.update_queue import ChatOrderedDispatcher
+
+
+# Типы обновлений, которые получает бот (и в polling, и в webhook)
+ALLOWED_UPDATES = ["message", "callback_query", "chat_member"]
 
 
 async def error_handler(event: ErrorEvent):
     """Глобальный обработчик ошибок для подавления спама от временных сетевых проблем."""
     exception = event.exception
+
+    # Circuit breaker разомкнут - о недоступности API он уже сообщил сам
+    if isinstance(exception, CircuitOpenError):
+        return True
     
     # Подавляем логирование частых сетевых ошибок Telegram
     if isinstance(exception, (TelegramServerError, TelegramNetworkError)):
@@ -60,59 +91,71 @@ async def error_handler(event: ErrorEvent):
     return True
 
 
-async def send_daily_messages(bot: Bot):
-    """Отправка утренних сообщений во все активные чаты."""
+async def send_daily_messages(bot: Bot, broadcast: Optional[str] = None):
+    """Утренний розыгрыш во всех активных чатах через outbox (продолжается после перезапуска)."""
     try:
         chat_ids = await get_active_chat_ids()
         if not chat_ids:
             logger.warning("Нет активных чатов для отправки сообщений.")
-            return
-
-        for chat_id in chat_ids:
-            try:
-                await send_random_message(bot, chat_id=chat_id)
-                logger.info(f"Сообщение отправлено в чат {chat_id}")
-                # Добавляем задержку между запросами для избежания flood control
-                await asyncio.sleep(REQUEST_DELAY)
-            except Exception as e:
-                logger.error(f"Ошибка при отправке сообщения в чат {chat_id}: {e}")
-    except Exception as e:
-        logger.error(f"Ошибка при получении активных чатов: {e}")
-
+            return None
 
-# Глобальная переменная для хранения задачи вечерних сообщений
-evening_cron_task = None
+        # Ключ рассылки: повторный запуск за тот же день добирает только недоставленные чаты
+        broadcast = broadcast or f"daily_bun:{clock.now():%Y-%m-%d}"
+        # Фаза 1: все победители разыгрываются одной транзакцией, фаза 2: анимации
+        await enqueue_daily_bun(broadcast, chat_ids)
+        return await deliver_broadcast(bot, broadcast)
+    except Exception as e:
+        logger.error(f"Ошибка при утреннем розыгрыше: {e}")
+        raise
 
 
 async def schedule_evening_message(bot: Bot):
     """Планирование отправки вечернего сообщения на фиксированное время 20:00."""
-    global evening_cron_task
-
     try:
         # Получаем фиксированное время для вечернего сообщения
         cron_time = get_random_evening_cron()
 
-        # Останавливаем предыдущую задачу, если она была
-        if evening_cron_task:
-            evening_cron_task.stop()
-            logger.info("Предыдущая задача вечерних сообщений остановлена")
-
-        # Создаем задачу на фиксированное время (20:00 каждый день)
-        evening_cron_task = aiocron.crontab(
-            cron_time,
-            func=lambda: asyncio.create_task(send_evening_humor(bot)),
-            start=True,
-        )
-
-        # Сразу стартуем задачу
-        evening_cron_task.start()
+        # Повторная регистрация заменяет предыдущее расписание
+        scheduler.add_job("evening_humor", cron_time, lambda: send_evening_humor(bot))
         logger.info(f"✅ Задача вечерних сообщений запущена: {cron_time}")
 
     except Exception as e:
         logger.error(f"Ошибка при планировании вечернего сообщения: {e}")
 
 
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Получение обновлений через webhook на встроенном aiohttp-сервере."""
+    app = web.Application()
+    # Запросы без верного X-Telegram-Bot-Api-Secret-Token отклоняются с 401
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Webhook-сервер слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
 
+    try:
+        await bot.set_webhook(
+            url=f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=ALLOWED_UPDATES,
+            drop_pending_updates=True,  # Пропускать старые обновления при запуске
+        )
+        logger.info("Webhook зарегистрирован в Telegram")
+        # Сервер работает до остановки бота
+        await asyncio.Event().wait()
+    finally:
+        # Снимаем webhook, иначе следующий запуск в режиме polling получит Conflict
+        try:
+            await bot.delete_webhook()
+            logger.info("Webhook удален из Telegram")
+        except Exception as e:
+            logger.error(f"Ошибка при удалении webhook: {e}")
+        await runner.cleanup()
 
 
 async def main():
@@ -127,12 +170,12 @@ async def main():
     signal.signal(signal.SIGINT, lambda s, f: signal_handler())
     signal.signal(signal.SIGTERM, lambda s, f: signal_handler())
 
-    # Создаем недостающие таблицы перед запуском бота
-    logger.info("Проверка и создание недостающих таблиц...")
+    # Приводим схему базы к актуальной версии перед запуском бота
+    logger.info("Проверка миграций схемы базы...")
     try:
-        await create_missing_tables()
+        await run_migrations()
     except Exception as e:
-        logger.error(f"Ошибка при создании таблиц: {e}")
+        logger.error(f"Ошибка при применении миграций: {e}")
         return
 
     bot = Bot(
@@ -141,7 +184,14 @@ async def main():
             parse_mode=ParseMode.HTML
         )
     )
-    dp = Dispatcher()
+    # Идемпотентные запросы повторяются при сетевых сбоях, каждая попытка проходит лимитер
+    setup_retry(bot)
+    # При недоступности Telegram API запросы отклоняются сразу, а не ждут таймаута
+    setup_circuit_breaker(bot)
+    # Все исходящие запросы проходят через общий лимитер Telegram API
+    setup_rate_limiter(bot)
+    # Обновления разных чатов обрабатываются параллельно, одного чата - по порядку
+    dp = ChatOrderedDispatcher()
     
     # Регистрируем глобальный обработчик ошибок
     dp.errors.register(error_handler)
@@ -164,18 +214,25 @@ async def main():
     try:
         try:
             # Запускаем задачу отправки сообщений каждое утро в 9:00 МСК
-            morning_cron_task = aiocron.crontab(
-                "0 9 * * *",
-                func=lambda: asyncio.create_task(send_daily_messages(bot)),
-                start=True,  # Запускаем сразу
-            )
-            morning_cron_task.start()
+            scheduler.add_job("daily_bun", "0 9 * * *", lambda: send_daily_messages(bot))
             logger.info("Задача отправки утренних сообщений запущена...")
 
             # Запускаем планировщик вечерних юморных сообщений
             await schedule_evening_message(bot)
             logger.info("Планировщик вечерних юморных сообщений запущен...")
 
+            # Задачи выполняет только владелец аренды; получив ее, он догоняет
+            # запуски, пропущенные, пока бот был остановлен или в резерве
+            lease_task = asyncio.create_task(
+                scheduler_lease.keep(on_acquired=scheduler.catch_up)
+            )
+
+            # Воркер outbox: повторы и рассылки, прерванные перезапуском
+            outbox_task = asyncio.create_task(run_outbox_worker(bot))
+
+            # Периодический перенос WAL в основной файл базы
+            checkpoint_task = asyncio.create_task(run_wal_checkpoint_worker())
+
         except Exception as e:
             logger.error(f"Ошибка при запуске задач: {e}")
         logger.info("🚀 Бот запущен и готов к работе!")
@@ -191,16 +248,28 @@ async def main():
         except Exception as e:
             logger.error(f"Ошибка в тестовом блоке: {e}", exc_info=True)
 
-        await dp.start_polling(
-            bot,
-            skip_updates=True,  # Пропускать старые обновления при запуске
-            allowed_updates=["message", "callback_query", "chat_member"],  # Только нужные типы
-            handle_as_tasks=False  # Обрабатывать обновления последовательно для стабильности
-        )
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            # Webhook, оставшийся от запуска в режиме webhook, блокирует getUpdates
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(
+                bot,
+                skip_updates=True,  # Пропускать старые обновления при запуске
+                allowed_updates=ALLOWED_UPDATES,  # Только нужные типы
+                # Порядок внутри чата обеспечивают очереди ChatOrderedDispatcher
+                handle_as_tasks=False
+            )
     except Exception as e:
         logger.error(f"Ошибка при работе бота: {e}")
     finally:
         logger.info("Завершение работы бота...")
+        await scheduler_lease.release()
+        try:
+            # Даем дообработаться уже принятым обновлениям
+            await asyncio.wait_for(dp.update_queue.join(), timeout=10)
+        except asyncio.TimeoutError:
+            logger.warning("Не все обновления обработаны до остановки")
         try:
             if bot and bot.session:
                 await bot.session.close()
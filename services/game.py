@@ -0,0 +1,97 @@
+# services/game.py
+"""Составные игровые операции: каждая - одна сессия, одна транзакция, один commit.
+
+Шаги операций - публичные функции database.queries, принимающие уже открытую
+сессию (без commit). Если любой шаг падает, откатывается вся операция целиком.
+"""
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.db import with_session
+from database.models import User, UserScore
+from database.queries import (
+    award_bun,
+    delete_member_rows,
+    distribute_points,
+)
+from logger import logger
+
+# Булочка, которую получает игрок без булочек при первом начислении очков
+STARTER_BUN = "Круассан"
+
+
+@with_session
+async def apply_points_delta(
+    session: AsyncSession, telegram_id: int, chat_id: int, points: int
+) -> tuple[int, bool]:
+    """Изменение очков игрока на points. Возвращает новые очки и флаг нового Круассана."""
+    return await _apply_points(session, telegram_id, chat_id, points)
+
+
+@with_session
+async def set_points_total(
+    session: AsyncSession, telegram_id: int, chat_id: int, total: int
+) -> tuple[int, bool]:
+    """Установка итога очков игрока. Возвращает новые очки и флаг нового Круассана.
+
+    Текущий итог читается в той же транзакции, поэтому начисления, прошедшие
+    между показом очков админу и вводом нового итога, не теряются.
+    """
+    result = await session.execute(
+        select(UserScore.total_points)
+        .join(User, User.id == UserScore.user_id)
+        .where(User.telegram_id == telegram_id, UserScore.chat_id == chat_id)
+    )
+    current = result.scalar() or 0
+    return await _apply_points(session, telegram_id, chat_id, max(0, total) - current)
+
+
+@with_session
+async def delete_member(session: AsyncSession, telegram_id: int, chat_id: int) -> bool:
+    """Полное удаление игрока из чата: булочки, итоги, выборы дня и сама запись."""
+    try:
+        return await delete_member_rows(session, telegram_id, chat_id)
+    except Exception as e:
+        logger.error(f"Ошибка при полном удалении пользователя {telegram_id} из чата {chat_id}: {e}")
+        raise
+
+
+async def _apply_points(
+    session: AsyncSession, telegram_id: int, chat_id: int, points: int
+) -> tuple[int, bool]:
+    """Начисление очков в открытой сессии; игрок без булочек сначала получает Круассан."""
+    result = await session.execute(
+        select(User.id).where(User.telegram_id == telegram_id, User.chat_id == chat_id)
+    )
+    user_id = result.scalar()
+    if not user_id:
+        logger.warning(
+            f"Пользователь telegram_id={telegram_id} не найден в чате {chat_id}"
+        )
+        return 0, False
+
+    result = await session.execute(
+        select(UserScore.total_points).where(
+            UserScore.user_id == user_id, UserScore.chat_id == chat_id
+        )
+    )
+    if result.scalar() is not None:  # Если булочки есть, добавляем только новые очки
+        return await distribute_points(session, user_id, chat_id, points), False
+
+    # Если булочек нет, добавляем Круассан с базовыми очками
+    user_bun = await award_bun(session, user_id, STARTER_BUN, chat_id)
+    if not user_bun:
+        logger.error(
+            f"Не удалось добавить {STARTER_BUN} для user_id={user_id} в чате {chat_id}"
+        )
+        return 0, False
+
+    base_points = user_bun.points
+    new_total = max(0, points)  # Итоговые очки равны запрошенным
+    if new_total != base_points:
+        # Корректируем до запрошенных очков
+        await distribute_points(session, user_id, chat_id, new_total - base_points)
+    logger.info(
+        f"Добавлен {STARTER_BUN} с базовыми {base_points} очками, итого: {new_total}"
+    )
+    return new_total, True  # True — это новый Круассан
@@ -0,0 +1,60 @@
+# utils/broadcast.py
+import asyncio
+import time
+from typing import Awaitable, Callable, Iterable
+
+from logger import logger
+
+
+class BroadcastReport:
+    """Итоги рассылки по множеству чатов."""
+
+    def __init__(self, name: str, total: int):
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.errors: dict[int, str] = {}  # chat_id -> текст ошибки
+        self.started_at = time.monotonic()
+        self.elapsed = 0.0
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.started_at
+
+    def summary(self) -> str:
+        return (
+            f"{self.name}: чатов {self.total}, успешно {self.done}, "
+            f"ошибок {self.failed}, время {self.elapsed:.1f} с"
+        )
+
+
+async def run_broadcast(
+    name: str,
+    chat_ids: Iterable[int],
+    worker: Callable[[int], Awaitable[object]],
+    concurrency: int,
+) -> BroadcastReport:
+    """Параллельный запуск worker(chat_id) для всех чатов, не больше concurrency одновременно.
+
+    Скорость запросов к API ограничивает лимитер сессии бота (utils.rate_limiter),
+    здесь ограничивается только число одновременно обрабатываемых чатов.
+    """
+    chat_ids = list(chat_ids)
+    report = BroadcastReport(name, len(chat_ids))
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(chat_id: int):
+        async with semaphore:
+            try:
+                await worker(chat_id)
+                report.done += 1
+                logger.debug(f"{name}: чат {chat_id} обработан")
+            except Exception as e:
+                report.failed += 1
+                report.errors[chat_id] = str(e)
+                logger.error(f"{name}: ошибка в чате {chat_id}: {e}")
+
+    await asyncio.gather(*(run_one(chat_id) for chat_id in chat_ids))
+    report.finish()
+    logger.info(report.summary())
+    return report
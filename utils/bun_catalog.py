@@ -0,0 +1,115 @@
+# utils/bun_catalog.py
+import random
+from types import MappingProxyType
+from typing import Hashable, Mapping, Sequence
+
+
+class AliasSampler:
+    """Случайный выбор по весам за O(1) на выбор (alias-метод Уокера-Воза).
+
+    Таблицы строятся один раз за O(n), дальше каждый выбор - одно случайное
+    число и одно сравнение, независимо от количества вариантов.
+    """
+
+    def __init__(self, items: Sequence[Hashable], weights: Sequence[float]):
+        if not items or len(items) != len(weights):
+            raise ValueError("Нужен непустой список вариантов и вес для каждого")
+        if any(weight <= 0 for weight in weights):
+            raise ValueError("Веса должны быть положительными")
+
+        n = len(items)
+        total = float(sum(weights))
+        self.items = list(items)
+        self.prob = [0.0] * n
+        self.alias = list(range(n))
+
+        # Масштабируем веса так, чтобы средний был 1, и делим на "малые" и "большие"
+        scaled = [weight * n / total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            # Большой вариант отдает малому недостающую долю ячейки
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Остатки из-за погрешности округления занимают ячейку целиком
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def sample(self, rng: random.Random = random) -> Hashable:
+        """Один случайный вариант с вероятностью, пропорциональной весу."""
+        i = rng.randrange(len(self.items))
+        return self.items[i] if rng.random() < self.prob[i] else self.items[self.alias[i]]
+
+
+class BunCatalog:
+    """Неизменяемый снимок каталога булочек: очки, веса редкости и готовый сэмплер.
+
+    После публикации снимок не меняется, поэтому очки и выбор булочки,
+    взятые из одного снимка, всегда согласованы между собой.
+    """
+
+    def __init__(self, buns: Sequence[tuple[str, int, int]] = ()):
+        """Построение снимка из строк (name, points, weight) таблицы buns."""
+        self.points: Mapping[str, int] = MappingProxyType(
+            {name: points for name, points, _ in buns}
+        )
+        self.weights: Mapping[str, int] = MappingProxyType(
+            {name: max(1, weight or 1) for name, _, weight in buns}
+        )
+        self._total_weight = sum(self.weights.values())
+        self._sampler = (
+            AliasSampler(list(self.weights), list(self.weights.values()))
+            if buns
+            else None
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.points)
+
+    def choose(self, rng: random.Random = random) -> str:
+        """Случайная булочка с учетом редкости."""
+        if self._sampler is None:
+            raise LookupError("Каталог булочек пуст")
+        return self._sampler.sample(rng)
+
+    def chance(self, name: str) -> float:
+        """Вероятность выпадения булочки за один розыгрыш."""
+        if not self._total_weight:
+            return 0.0
+        return self.weights.get(name, 0) / self._total_weight
+
+
+class BunCatalogCache:
+    """Текущий опубликованный снимок каталога булочек.
+
+    Загружается из базы при первом обращении; после commit изменений таблицы
+    buns invalidate увеличивает version и снимает снимок с публикации,
+    а следующий читатель строит новый. Старые снимки у тех, кто их уже взял,
+    остаются целыми.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.current: BunCatalog | None = None
+
+    def publish(self, catalog: BunCatalog, version: int) -> BunCatalog:
+        """Публикация снимка, прочитанного при version.
+
+        Если каталог успели сбросить во время чтения, снимок возвращается
+        вызывающему, но не публикуется и перечитается при следующем обращении.
+        """
+        if version == self.version:
+            self.current = catalog
+        return catalog
+
+    def invalidate(self, *_):
+        """Сброс каталога после изменения таблицы buns."""
+        self.version += 1
+        self.current = None
+
+
+# Общий каталог булочек на весь процесс
+bun_catalog = BunCatalogCache()
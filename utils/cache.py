@@ -0,0 +1,82 @@
+# utils/cache.py
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from config import LEADERBOARD_CACHE_SIZE, MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TTL
+
+
+class LRUCache:
+    """Ограниченный кэш в памяти: при переполнении вытесняется давно не читанный ключ.
+
+    С ttl записи еще и устаревают через ttl секунд после записи - это ограничивает
+    рассинхрон, если базу меняет другой экземпляр бота.
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Растет при каждом сбросе: чтение, начатое до сброса, не кладет в кэш старые данные
+        self.version = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Значение по ключу (ключ становится самым свежим) или default."""
+        entry = self._data.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            del self._data[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any, version: int | None = None):
+        """Запись значения с вытеснением самых старых ключей сверх maxsize.
+
+        version - значение self.version до чтения из базы: если с тех пор был
+        сброс, значение могло устареть и не записывается.
+        """
+        if version is not None and version != self.version:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, *keys: Hashable):
+        """Сброс значений по ключам; без ключей - сброс всего кэша."""
+        self.version += 1
+        if not keys:
+            self._data.clear()
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self):
+        self.invalidate()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов для мониторинга."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+# Топ-10 /stats по чатам; сбрасывается после commit изменений очков и игроков чата
+leaderboard_cache = LRUCache(LEADERBOARD_CACHE_SIZE)
+
+# Участие в чате по (telegram_id, chat_id), включая "не участник"
+membership_cache = LRUCache(MEMBERSHIP_CACHE_SIZE, ttl=MEMBERSHIP_CACHE_TTL)
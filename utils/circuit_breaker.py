@@ -0,0 +1,133 @@
+# utils/circuit_breaker.py
+import time
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from config import CB_FAILURE_THRESHOLD, CB_RECOVERY_TIMEOUT
+from logger import logger
+from utils.retry import is_transient_telegram_error
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: Telegram API недоступен, circuit breaker разомкнут."""
+
+
+class CircuitBreaker:
+    """Circuit breaker: closed -> open после серии сбоев -> half-open с одним пробным запросом."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = CB_FAILURE_THRESHOLD,
+        recovery_timeout: float = CB_RECOVERY_TIMEOUT,
+    ):
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        """Запросы сейчас отклоняются (разомкнут и время пробы еще не пришло)."""
+        return (
+            self.state == self.OPEN
+            and time.monotonic() - self.opened_at < self.recovery_timeout
+        )
+
+    def before_request(self):
+        """Разрешение на запрос или CircuitOpenError."""
+        if self.state == self.CLOSED:
+            return
+        if self.state == self.OPEN:
+            if self.is_open:
+                raise CircuitOpenError("Telegram API недоступен, запрос отклонен")
+            self.state = self.HALF_OPEN
+            logger.info("Circuit breaker: пробный запрос к Telegram API")
+        # Half-open: пропускаем ровно один пробный запрос
+        if self.probe_in_flight:
+            raise CircuitOpenError("Telegram API проверяется, запрос отклонен")
+        self.probe_in_flight = True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("✅ Circuit breaker замкнут: Telegram API снова доступен")
+        self.state = self.CLOSED
+        self.failures = 0
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(
+                    f"Circuit breaker разомкнут после {self.failures} сбоев подряд, "
+                    f"запросы отклоняются {self.recovery_timeout:.0f} с"
+                )
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Пробный запрос прерван (отмена задачи) - доступность API неизвестна."""
+        self.probe_in_flight = False
+
+
+class CircuitBreakerMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: запросы не уходят в недоступный Telegram API."""
+
+    # Long polling сам делает паузы при сбоях
+    EXEMPT_METHODS = (GetUpdates,)
+
+    def __init__(self, breaker: CircuitBreaker):
+        self.breaker = breaker
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if isinstance(method, self.EXEMPT_METHODS):
+            return await make_request(bot, method)
+
+        self.breaker.before_request()
+        try:
+            result = await make_request(bot, method)
+        except Exception as e:
+            if is_transient_telegram_error(e):
+                self.breaker.record_failure()
+            else:
+                # Ответ от Telegram получен - API доступен
+                self.breaker.record_success()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return result
+
+
+# Общий circuit breaker на весь процесс
+circuit_breaker = CircuitBreaker()
+
+
+def setup_circuit_breaker(bot: Bot) -> CircuitBreakerMiddleware:
+    """Подключение circuit breaker к сессии бота."""
+    middleware = CircuitBreakerMiddleware(circuit_breaker)
+    bot.session.middleware(middleware)
+    logger.info(
+        f"Circuit breaker подключен: порог {CB_FAILURE_THRESHOLD} сбоев, "
+        f"проба через {CB_RECOVERY_TIMEOUT} с"
+    )
+    return middleware
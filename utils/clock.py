@@ -0,0 +1,42 @@
+# utils/clock.py
+from datetime import datetime, timedelta, tzinfo
+from typing import Optional, Protocol
+
+
+class Clock(Protocol):
+    def now(self, tz: Optional[tzinfo] = None) -> datetime: ...
+
+
+class SystemClock:
+    """Настоящее время системы."""
+
+    def now(self, tz: Optional[tzinfo] = None) -> datetime:
+        return datetime.now(tz)
+
+
+class SimulatedClock:
+    """Управляемое время для симуляций: стоит на месте, пока его не сдвинут."""
+
+    def __init__(self, start: datetime):
+        self.current = start  # Локальное время без часового пояса, как datetime.now()
+
+    def now(self, tz: Optional[tzinfo] = None) -> datetime:
+        return self.current.astimezone(tz) if tz else self.current
+
+    def advance(self, delta: timedelta):
+        self.current += delta
+
+
+_clock: Clock = SystemClock()
+
+
+def now(tz: Optional[tzinfo] = None) -> datetime:
+    """Текущее время по установленным часам (по умолчанию - системным)."""
+    return _clock.now(tz)
+
+
+def set_clock(clock: Clock) -> Clock:
+    """Подмена часов (для симуляций); возвращает предыдущие часы."""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
@@ -0,0 +1,200 @@
+# utils/draw_simulation.py
+"""Симуляция честного розыгрыша на временной базе SQLite.
+
+Прогоняет N чатов x M игроков x D дней с подмененными часами и печатает
+распределение побед, самые длинные перерывы между победами, задержки
+розыгрыша и то, как они меняются по мере накопления истории.
+
+Запуск:
+    python -m utils.draw_simulation --chats 20 --users 15 --days 365
+    python -m utils.draw_simulation --mode single  # draw_daily_winners по одному чату
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+
+def prepare_environment(db_path: str):
+    """Переменные окружения до импорта config: временная база и тихие логи."""
+    os.environ["DB_PATH"] = db_path
+    os.environ.setdefault("API_TOKEN", "simulation")
+    os.environ.setdefault("ADMIN_ID", "0")
+    os.environ.setdefault("FOR_LOGS", "0")
+    os.environ["LOG_TO_TELEGRAM"] = "false"
+    os.environ["LOG_TO_FILE"] = "false"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Перцентиль q (0..100) по отсортированному списку (ближайший ранг)."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_simulation(
+    chats: int, users: int, days: int, mode: str, start: datetime
+) -> dict:
+    """Прогон симуляции; возвращает сырые результаты для отчета."""
+    from sqlalchemy import event
+
+    from database import queries
+    from database.db import engine
+    from database.migrations import run_migrations
+    from database.models import User
+    from utils.clock import SimulatedClock, set_clock
+
+    sim_clock = SimulatedClock(start)
+    set_clock(sim_clock)
+
+    await run_migrations()
+    await queries.add_bun("Круассан", 2)
+    chat_ids = [-(1000 + i) for i in range(chats)]
+    async with engine.begin() as conn:
+        await conn.execute(
+            User.__table__.insert(),
+            [
+                {
+                    "telegram_id": chat_index * users + user_index + 1,
+                    "username": f"baker_{chat_index}_{user_index}",
+                    "full_name": f"Пекарь {user_index}",
+                    "chat_id": chat_id,
+                    "in_game": True,
+                }
+                for chat_index, chat_id in enumerate(chat_ids)
+                for user_index in range(users)
+            ],
+        )
+
+    statements = 0
+
+    def count_statement(*args):
+        nonlocal statements
+        statements += 1
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count_statement)
+
+    wins: dict[int, dict[int, list[int]]] = defaultdict(lambda: defaultdict(list))
+    draws = []  # (день, секунды, SQL-запросов) на каждый вызов розыгрыша
+    try:
+        for day in range(days):
+            sim_clock.current = start + timedelta(days=day)
+            if mode == "batch":
+                before, started = statements, time.perf_counter()
+                result = await queries.draw_daily_winners(chat_ids)
+                draws.append((day, time.perf_counter() - started, statements - before))
+                for chat_id, winner in result["winners"].items():
+                    if winner:
+                        wins[chat_id][winner["user_id"]].append(day)
+            else:
+                for chat_id in chat_ids:
+                    before, started = statements, time.perf_counter()
+                    result = await queries.draw_daily_winners([chat_id])
+                    draws.append(
+                        (day, time.perf_counter() - started, statements - before)
+                    )
+                    winner = result["winners"].get(chat_id)
+                    if winner:
+                        wins[chat_id][winner["user_id"]].append(day)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", count_statement)
+        await engine.dispose()
+
+    return {"wins": wins, "draws": draws}
+
+
+def build_report(results: dict, chats: int, users: int, days: int, mode: str) -> str:
+    """Текстовый отчет о честности и скорости розыгрыша."""
+    wins, draws = results["wins"], results["draws"]
+    lines = [f"🥐 Симуляция розыгрыша ({mode}): {chats} чатов x {users} игроков x {days} дней", ""]
+
+    # Честность: доли побед, игроки без побед, повторы подряд и перерывы
+    shares, never_won, repeats, longest_gaps = [], 0, 0, []
+    for chat_wins in wins.values():
+        total = sum(len(user_days) for user_days in chat_wins.values())
+        never_won += users - len(chat_wins)
+        shares.extend([0.0] * (users - len(chat_wins)))
+        for user_days in chat_wins.values():
+            shares.append(len(user_days) / total)
+            # Перерыв считается и от начала симуляции до первой победы
+            points = [-1] + user_days
+            gaps = [b - a for a, b in zip(points, points[1:])]
+            repeats += sum(1 for gap in gaps[1:] if gap == 1)
+            longest_gaps.append(max(gaps))
+    expected = 1 / users
+    shares = sorted(shares) or [0.0]
+    longest_gaps = sorted(longest_gaps) or [0]
+    lines += [
+        "📊 Доли побед игроков",
+        f"  ожидаемая: {expected:.2%}",
+        f"  мин / медиана / макс: {shares[0]:.2%} / {statistics.median(shares):.2%} / {shares[-1]:.2%}",
+        f"  разброс (стандартное отклонение): {statistics.pstdev(shares):.2%}",
+        f"  игроков без единой победы: {never_won}",
+        f"  побед два дня подряд: {repeats}",
+        "",
+        "⏳ Самый длинный перерыв между победами игрока (дней)",
+        f"  медиана / p90 / макс: {statistics.median(longest_gaps):.0f} / "
+        f"{percentile(longest_gaps, 90):.0f} / {longest_gaps[-1]:.0f}",
+        "",
+    ]
+
+    # Скорость: перцентили задержки и SQL-запросы на один розыгрыш
+    latencies = sorted(seconds * 1000 for _, seconds, _ in draws)
+    lines += [
+        "⚡ Задержка одного розыгрыша (мс)",
+        f"  p50 / p90 / p99 / макс: {percentile(latencies, 50):.2f} / "
+        f"{percentile(latencies, 90):.2f} / {percentile(latencies, 99):.2f} / {latencies[-1]:.2f}",
+        f"  SQL-запросов на розыгрыш: {statistics.mean(n for _, _, n in draws):.1f}",
+        "",
+        "📈 Рост стоимости по мере накопления истории",
+    ]
+    buckets = min(5, days)
+    for bucket in range(buckets):
+        first, last = bucket * days // buckets, (bucket + 1) * days // buckets - 1
+        part = [(seconds, n) for day, seconds, n in draws if first <= day <= last]
+        lines.append(
+            f"  дни {first + 1}-{last + 1}: {statistics.mean(s for s, _ in part) * 1000:.2f} мс, "
+            f"{statistics.mean(n for _, n in part):.1f} запросов"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Симуляция честного розыгрыша Булочки Дня")
+    parser.add_argument("--chats", type=int, default=20, help="Количество чатов")
+    parser.add_argument("--users", type=int, default=15, help="Игроков в каждом чате")
+    parser.add_argument("--days", type=int, default=365, help="Сколько дней симулировать")
+    parser.add_argument(
+        "--mode",
+        choices=["batch", "single"],
+        default="batch",
+        help="batch - draw_daily_winners по всем чатам, single - по одному чату за вызов",
+    )
+    parser.add_argument("--start", default="2025-01-01", help="Первый день (YYYY-MM-DD)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed генератора случайных чисел")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        import random
+
+        random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare_environment(os.path.join(tmp, "simulation.db"))
+        start = datetime.strptime(args.start, "%Y-%m-%d").replace(hour=9)
+        results = asyncio.run(
+            run_simulation(args.chats, args.users, args.days, args.mode, start)
+        )
+    print(build_report(results, args.chats, args.users, args.days, args.mode))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
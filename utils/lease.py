@@ -0,0 +1,74 @@
+# utils/lease.py
+import asyncio
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Optional
+from uuid import uuid4
+
+from config import LEASE_TTL, LEASE_HEARTBEAT
+from database.queries import try_acquire_lease, release_lease
+from logger import logger
+
+
+class LeaseKeeper:
+    """Удержание аренды в базе: только владелец выполняет задачи по расписанию.
+
+    Аренда продлевается каждые heartbeat секунд. Если владелец перестал ее
+    продлевать, через ttl секунд роль забирает другой экземпляр.
+    """
+
+    def __init__(self, name: str, ttl: float = LEASE_TTL, heartbeat: float = LEASE_HEARTBEAT):
+        self.name = name
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.valid_until = 0.0
+
+    @property
+    def is_held(self) -> bool:
+        """Аренда наша и гарантированно не истекла (по локальным часам)."""
+        return time.monotonic() < self.valid_until
+
+    async def renew(self) -> bool:
+        """Одна попытка захватить или продлить аренду."""
+        started = time.monotonic()
+        try:
+            acquired = await try_acquire_lease(self.name, self.holder, self.ttl)
+        except Exception as e:
+            logger.error(f"Не удалось продлить аренду {self.name}: {e}")
+            return self.is_held
+        self.valid_until = started + self.ttl if acquired else 0.0
+        return acquired
+
+    async def keep(self, on_acquired: Optional[Callable[[], Awaitable[object]]] = None):
+        """Фоновое удержание аренды; on_acquired вызывается при получении роли."""
+        logger.info(f"Экземпляр {self.holder} претендует на аренду {self.name}")
+        was_held = False
+        while True:
+            held = await self.renew()
+            if held and not was_held:
+                logger.info(f"👑 Экземпляр {self.holder} получил аренду {self.name}")
+                if on_acquired:
+                    asyncio.create_task(on_acquired())
+            elif was_held and not held:
+                logger.warning(
+                    f"Экземпляр {self.holder} потерял аренду {self.name}, переходит в резерв"
+                )
+            was_held = held
+            await asyncio.sleep(self.heartbeat)
+
+    async def release(self):
+        """Освобождение аренды при штатной остановке (резерв подхватит сразу)."""
+        if not self.is_held:
+            return
+        self.valid_until = 0.0
+        try:
+            await release_lease(self.name, self.holder)
+            logger.info(f"Аренда {self.name} освобождена")
+        except Exception as e:
+            logger.error(f"Не удалось освободить аренду {self.name}: {e}")
+
+
+# Аренда задач по расписанию и фоновых рассылок
+scheduler_lease = LeaseKeeper("scheduler")
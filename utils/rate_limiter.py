@@ -0,0 +1,182 @@
+# utils/rate_limiter.py
+import asyncio
+import time
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.methods import GetUpdates, TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from config import (
+    TG_GLOBAL_RATE,
+    TG_CHAT_RATE_PER_MINUTE,
+    TG_PRIVATE_CHAT_RATE_PER_MINUTE,
+    TG_CHAT_BURST,
+    TG_RETRY_AFTER_ATTEMPTS,
+)
+from logger import logger
+
+
+class TokenBucket:
+    """Асинхронный token bucket: rate токенов в секунду, не больше capacity в запасе."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Ожидание свободного токена (ожидающие обслуживаются по очереди)."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Остановка выдачи токенов на seconds секунд (ответ Telegram retry_after).
+
+        Сразу после паузы доступен один токен, чтобы повтор запроса не ждал
+        еще целый интервал ведра сверх retry_after.
+        """
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = min(self.capacity, 1.0)
+        self.updated = self.paused_until
+
+    def is_idle(self) -> bool:
+        """Ведро полное и никто его не ждет - можно выбросить."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        return self.tokens >= self.capacity and not self._lock.locked()
+
+
+class TelegramRateLimiter:
+    """Общий лимит запросов к Telegram API: глобальное ведро + ведро на каждый чат.
+
+    Личные чаты (chat_id > 0) получают свою, более высокую скорость.
+    """
+
+    MAX_CHAT_BUCKETS = 10000  # После этого порога выбрасываем простаивающие ведра
+
+    def __init__(
+        self,
+        global_rate: float = TG_GLOBAL_RATE,
+        chat_rate_per_minute: float = TG_CHAT_RATE_PER_MINUTE,
+        chat_burst: int = TG_CHAT_BURST,
+        private_chat_rate_per_minute: float = TG_PRIVATE_CHAT_RATE_PER_MINUTE,
+    ):
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.chat_rate = chat_rate_per_minute / 60
+        self.private_chat_rate = private_chat_rate_per_minute / 60
+        self.chat_burst = chat_burst
+        self.chat_buckets: dict[int | str, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                self._cleanup()
+            private = isinstance(chat_id, int) and chat_id > 0
+            bucket = TokenBucket(
+                self.private_chat_rate if private else self.chat_rate, self.chat_burst
+            )
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _cleanup(self):
+        idle = [key for key, bucket in self.chat_buckets.items() if bucket.is_idle()]
+        for key in idle:
+            del self.chat_buckets[key]
+
+    async def acquire(self, chat_id: Optional[int | str] = None):
+        """Ожидание разрешения на один запрос (сначала лимит чата, затем глобальный)."""
+        if chat_id is not None:
+            await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+    def pause(self, chat_id: Optional[int | str], seconds: float):
+        """Пауза ведра, на которое пришел flood control: чата, а без чата - глобального."""
+        if chat_id is not None:
+            self._chat_bucket(chat_id).pause(seconds)
+        else:
+            self.global_bucket.pause(seconds)
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: каждый исходящий запрос проходит через общий лимитер.
+
+    При TelegramRetryAfter ведро ставится на паузу, а запрос повторяется автоматически.
+    """
+
+    # Long polling не расходует лимит сообщений
+    EXEMPT_METHODS = (GetUpdates,)
+
+    def __init__(
+        self,
+        limiter: Optional[TelegramRateLimiter] = None,
+        max_attempts: int = TG_RETRY_AFTER_ATTEMPTS,
+    ):
+        self.limiter = limiter or TelegramRateLimiter()
+        self.max_attempts = max(1, max_attempts)
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if isinstance(method, self.EXEMPT_METHODS):
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        attempt = 1
+        while True:
+            await self.limiter.acquire(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.limiter.pause(chat_id, e.retry_after)
+                if attempt >= self.max_attempts:
+                    raise
+                logger.warning(
+                    f"Flood control на {type(method).__name__} (чат {chat_id}): "
+                    f"пауза {e.retry_after} с, попытка {attempt}/{self.max_attempts}"
+                )
+                attempt += 1
+
+
+# Общий лимитер на весь процесс
+rate_limiter = TelegramRateLimiter()
+
+
+def setup_rate_limiter(bot: Bot) -> RateLimitMiddleware:
+    """Подключение общего лимитера к сессии бота."""
+    middleware = RateLimitMiddleware(rate_limiter)
+    bot.session.middleware(middleware)
+    logger.info(
+        f"Лимитер Telegram API подключен: {TG_GLOBAL_RATE} req/s глобально, "
+        f"{TG_CHAT_RATE_PER_MINUTE} req/min на чат, "
+        f"{TG_PRIVATE_CHAT_RATE_PER_MINUTE} req/min на личный чат"
+    )
+    return middleware
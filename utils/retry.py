@@ -0,0 +1,176 @@
+# utils/retry.py
+import asyncio
+import random
+from collections import defaultdict
+from typing import Awaitable, Callable, TypeVar
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramNetworkError,
+    TelegramServerError,
+)
+from aiogram.client.session.middlewares.base import (
+    BaseRequestMiddleware,
+    NextRequestMiddlewareType,
+)
+from aiogram.methods import (
+    DeleteMessage,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    GetChat,
+    GetChatMember,
+    GetMe,
+    SetMyCommands,
+    TelegramMethod,
+)
+from aiogram.methods.base import Response, TelegramType
+from sqlalchemy.exc import OperationalError
+
+from config import MAX_RETRIES, RETRY_DELAY, RETRY_MAX_DELAY
+from logger import logger
+
+T = TypeVar("T")
+
+
+class RetryStats:
+    """Счетчики повторов и окончательных неудач по операциям."""
+
+    def __init__(self):
+        self.retries: dict[str, int] = defaultdict(int)
+        self.failures: dict[str, int] = defaultdict(int)
+
+    def record_retry(self, name: str):
+        self.retries[name] += 1
+
+    def record_failure(self, name: str):
+        self.failures[name] += 1
+
+    @property
+    def total_retries(self) -> int:
+        return sum(self.retries.values())
+
+    @property
+    def total_failures(self) -> int:
+        return sum(self.failures.values())
+
+    def summary(self) -> str:
+        return f"повторов {self.total_retries}, окончательных неудач {self.total_failures}"
+
+
+# Общие счетчики на весь процесс
+retry_stats = RetryStats()
+
+
+def backoff_delay(
+    attempt: int, base_delay: float = RETRY_DELAY, max_delay: float = RETRY_MAX_DELAY
+) -> float:
+    """Экспоненциальная задержка с полным разбросом (full jitter) перед попыткой attempt + 1."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def is_transient_telegram_error(error: BaseException) -> bool:
+    """Сетевые сбои и 5xx от Telegram - запрос имеет смысл повторить."""
+    return isinstance(error, (TelegramNetworkError, TelegramServerError))
+
+
+def is_db_locked(error: BaseException) -> bool:
+    """SQLite занят другой транзакцией ("database is locked")."""
+    return isinstance(error, OperationalError) and "database is locked" in str(error)
+
+
+async def retry_async(
+    func: Callable[..., Awaitable[T]],
+    *args,
+    name: str,
+    retry_if: Callable[[BaseException], bool],
+    max_attempts: int = MAX_RETRIES,
+    base_delay: float = RETRY_DELAY,
+    **kwargs,
+) -> T:
+    """Вызов func с повторами при ошибках, для которых retry_if возвращает True.
+
+    Всего не больше max_attempts попыток, между ними - экспоненциальная задержка
+    с разбросом. Последняя ошибка пробрасывается вызывающему.
+    """
+    max_attempts = max(1, max_attempts)
+    attempt = 1
+    while True:
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            if not retry_if(e):
+                raise
+            if attempt >= max_attempts:
+                retry_stats.record_failure(name)
+                logger.error(f"{name}: не удалось после {attempt} попыток: {e}")
+                raise
+            delay = backoff_delay(attempt, base_delay)
+            retry_stats.record_retry(name)
+            logger.warning(
+                f"{name}: попытка {attempt}/{max_attempts} неудачна ({e}), "
+                f"повтор через {delay:.1f} с"
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+class RetryMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: повтор идемпотентных запросов при сетевых сбоях.
+
+    Отправка новых сообщений не повторяется - при обрыве соединения сообщение
+    могло уже дойти, а повторы рассылок выполняет outbox.
+    """
+
+    IDEMPOTENT_METHODS = (
+        EditMessageText,
+        EditMessageReplyMarkup,
+        DeleteMessage,
+        GetChat,
+        GetChatMember,
+        GetMe,
+        SetMyCommands,
+    )
+
+    def __init__(self, max_attempts: int = MAX_RETRIES):
+        self.max_attempts = max_attempts
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not isinstance(method, self.IDEMPOTENT_METHODS):
+            return await make_request(bot, method)
+
+        attempts = 0
+
+        async def request():
+            nonlocal attempts
+            attempts += 1
+            try:
+                return await make_request(bot, method)
+            except TelegramBadRequest as e:
+                # Первая попытка дошла до Telegram, хотя ответ потерялся
+                if attempts > 1 and "message is not modified" in str(e):
+                    return True
+                raise
+
+        return await retry_async(
+            request,
+            name=f"telegram.{type(method).__name__}",
+            retry_if=is_transient_telegram_error,
+            max_attempts=self.max_attempts,
+        )
+
+
+def setup_retry(bot: Bot) -> RetryMiddleware:
+    """Подключение повторов к сессии бота (до лимитера: каждая попытка проходит лимит)."""
+    middleware = RetryMiddleware()
+    bot.session.middleware(middleware)
+    logger.info(
+        f"Повторы запросов подключены: до {MAX_RETRIES} попыток, "
+        f"базовая задержка {RETRY_DELAY} с"
+    )
+    return middleware
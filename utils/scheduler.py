@@ -0,0 +1,125 @@
+# utils/scheduler.py
+import asyncio
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Optional
+
+import aiocron
+from croniter import croniter
+
+from config import CATCHUP_GRACE_MINUTES, CATCHUP_STAGGER
+from database.queries import get_job_last_runs, record_job_run
+from logger import logger
+from utils import clock
+from utils.lease import scheduler_lease
+
+
+class ScheduledJob:
+    """Задача по расписанию: имя, cron-выражение и корутина без аргументов."""
+
+    def __init__(self, name: str, spec: str, func: Callable[[], Awaitable[object]]):
+        self.name = name
+        self.spec = spec
+        self.func = func
+        self.cron: Optional[aiocron.Cron] = None
+        self.running = False
+
+    def previous_fire_time(self, now: datetime) -> datetime:
+        """Последний момент по расписанию, не позже now."""
+        return croniter(self.spec, now).get_prev(datetime)
+
+
+class JobScheduler:
+    """Планировщик поверх aiocron: запоминает успешные запуски в базе
+    и при старте догоняет задачи, пропущенные во время простоя."""
+
+    def __init__(self):
+        self.jobs: dict[str, ScheduledJob] = {}
+
+    def add_job(
+        self, name: str, spec: str, func: Callable[[], Awaitable[object]]
+    ) -> ScheduledJob:
+        """Регистрация (или замена) задачи и запуск ее по расписанию."""
+        old_job = self.jobs.get(name)
+        if old_job and old_job.cron:
+            old_job.cron.stop()
+            logger.info(f"Предыдущее расписание задачи {name} остановлено")
+
+        job = ScheduledJob(name, spec, func)
+        job.cron = aiocron.crontab(
+            spec,
+            func=lambda: asyncio.create_task(self.run_job(name)),
+            start=True,
+        )
+        self.jobs[name] = job
+        logger.info(f"✅ Задача {name} запланирована: {spec}")
+        return job
+
+    async def run_job(self, name: str) -> bool:
+        """Запуск задачи с записью успешного завершения в базу."""
+        job = self.jobs[name]
+        # Задачи выполняет только владелец аренды, остальные экземпляры в резерве
+        if not scheduler_lease.is_held:
+            logger.info(f"Задача {name} пропущена: экземпляр не владеет арендой")
+            return False
+        if job.running:
+            logger.warning(f"Задача {name} еще выполняется, запуск пропущен")
+            return False
+
+        job.running = True
+        try:
+            await job.func()
+        except Exception as e:
+            logger.error(f"Ошибка при выполнении задачи {name}: {e}")
+            return False
+        finally:
+            job.running = False
+
+        try:
+            await record_job_run(name, clock.now())
+        except Exception as e:
+            logger.error(f"Не удалось записать запуск задачи {name}: {e}")
+        return True
+
+    async def catch_up(
+        self,
+        grace: timedelta = timedelta(minutes=CATCHUP_GRACE_MINUTES),
+        stagger: float = CATCHUP_STAGGER,
+    ) -> list[str]:
+        """Запуск задач, чье время по расписанию прошло за время простоя.
+
+        Догоняются только запуски не старше grace; задачи выполняются
+        по очереди с паузой stagger, а не одной пачкой.
+        """
+        if not scheduler_lease.is_held:
+            return []
+        now = clock.now()
+        last_runs = await get_job_last_runs()
+
+        missed = []
+        for job in self.jobs.values():
+            fire_time = job.previous_fire_time(now)
+            last_run = last_runs.get(job.name)
+            if last_run is not None and last_run >= fire_time:
+                continue
+            if now - fire_time > grace:
+                logger.info(
+                    f"Задача {job.name} пропущена в {fire_time:%d.%m %H:%M}, "
+                    f"но окно догона ({grace}) уже истекло"
+                )
+                continue
+            missed.append((fire_time, job))
+
+        missed.sort(key=lambda item: item[0])
+        for i, (fire_time, job) in enumerate(missed):
+            if i:
+                await asyncio.sleep(stagger)
+            logger.warning(
+                f"⏰ Догоняем пропущенный запуск {job.name} "
+                f"(по расписанию {fire_time:%d.%m %H:%M})"
+            )
+            await self.run_job(job.name)
+        return [job.name for _, job in missed]
+
+
+# Общий планировщик на весь процесс
+scheduler = JobScheduler()
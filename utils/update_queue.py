@@ -0,0 +1,101 @@
+# utils/update_queue.py
+import asyncio
+from collections import deque
+from functools import partial
+from typing import Any, Awaitable, Callable, Hashable
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import UPDATE_WORKERS, UPDATE_QUEUE_LIMIT
+from logger import logger
+
+
+class KeyedSerialQueue:
+    """Очереди задач по ключу: внутри ключа строго по порядку, между ключами параллельно.
+
+    Одновременно выполняется не больше workers задач, а в очередях ожидает
+    не больше limit задач - дальше submit ждет освобождения места.
+    """
+
+    def __init__(self, workers: int, limit: int):
+        self._queues: dict[Hashable, deque] = {}
+        self._workers = asyncio.Semaphore(max(1, workers))
+        self._capacity = asyncio.Semaphore(max(1, limit))
+        self._tasks: set[asyncio.Task] = set()
+        self.pending = 0
+
+    async def submit(self, key: Hashable, job: Callable[[], Awaitable[Any]]):
+        """Постановка задачи в очередь ключа (ждет, если очереди переполнены)."""
+        await self._capacity.acquire()
+        self.pending += 1
+        queue = self._queues.get(key)
+        if queue is not None:
+            # Очередь ключа уже обрабатывается - задача выполнится после предыдущих
+            queue.append(job)
+            return
+        self._queues[key] = deque([job])
+        task = asyncio.create_task(self._drain(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, key: Hashable):
+        queue = self._queues[key]
+        try:
+            while queue:
+                async with self._workers:
+                    try:
+                        await queue[0]()
+                    except Exception as e:
+                        logger.error(f"Ошибка при обработке задачи очереди {key}: {e}")
+                    finally:
+                        queue.popleft()
+                        self.pending -= 1
+                        self._capacity.release()
+        finally:
+            del self._queues[key]
+
+    async def join(self):
+        """Ожидание обработки всех поставленных задач."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def update_chat_key(update: Update) -> Hashable:
+    """Ключ упорядочивания обновления: чат, а если чата нет - пользователь."""
+    event = update.event
+    chat = getattr(event, "chat", None)
+    if chat is None and getattr(event, "message", None) is not None:
+        chat = event.message.chat
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return f"user:{user.id}"
+    return "global"
+
+
+class ChatOrderedDispatcher(Dispatcher):
+    """Dispatcher, обрабатывающий обновления разных чатов параллельно,
+    а обновления одного чата - строго по порядку поступления."""
+
+    def __init__(
+        self,
+        *args: Any,
+        workers: int = UPDATE_WORKERS,
+        queue_limit: int = UPDATE_QUEUE_LIMIT,
+        **kwargs: Any,
+    ):
+        super().__init__(*args, **kwargs)
+        self.update_queue = KeyedSerialQueue(workers, queue_limit)
+
+    async def feed_update(self, bot: Bot, update: Update, **kwargs: Any) -> Any:
+        """Постановка обновления в очередь его чата вместо обработки на месте.
+
+        Polling при переполненных очередях ждет здесь и не запрашивает новые обновления.
+        """
+        await self.update_queue.submit(
+            update_chat_key(update),
+            partial(super().feed_update, bot, update, **kwargs),
+        )
+        return None